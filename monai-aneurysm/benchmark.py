@@ -0,0 +1,603 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from monai.data import MetaTensor
+from monai.transforms import Compose
+
+from data_preparation import FULL_RESOLUTION_CONFIG, PREPROCESS_CONFIG, get_deterministic_transforms
+from precision import PRECISIONS, autocast, check_precision, grad_scaler, to_channels_last
+from utils import as_plain_tensor, peak_rss_bytes
+
+# Caching modes of the training loader: preprocess every sample each epoch,
+# read preprocessed volumes from the on-disk cache, or rotate a RAM cache
+# over the on-disk one.
+CACHE_MODES = ('none', 'disk', 'rotating')
+
+
+def synthetic_volume(shape=(512, 512, 160), spacing=(0.44, 0.44, 0.6), seed=0):
+    """
+    Builds a CTA-like head: a noisy soft-tissue ellipsoid with a few bright
+    vessels, surrounded by air. Returned channel-first with a RAS affine.
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.ogrid[tuple(slice(0, s) for s in shape)]
+    center = [s / 2 for s in shape]
+    radius = [0.4 * s for s in shape]
+    inside = sum(((g - c) / r) ** 2 for g, c, r in zip(grid, center, radius)) <= 1.0
+
+    volume = np.full(shape, -1000.0, dtype=np.float32)
+    volume[inside] = 40.0
+    volume += rng.normal(0, 10, shape).astype(np.float32)
+    for _ in range(8):
+        x, y = (rng.integers(s // 3, 2 * s // 3) for s in shape[:2])
+        volume[x - 2:x + 2, y - 2:y + 2, :] = 300.0
+
+    affine = np.diag(list(spacing) + [1.0])
+    return MetaTensor(torch.from_numpy(volume)[None], affine=torch.as_tensor(affine))
+
+
+def _time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    return out, times
+
+
+def bench_preprocess(args):
+    """
+    Times the fused deterministic chain against the reference
+    Spacingd -> CropForegroundd -> Resized chain on the same loaded volume.
+    The fused output must stay within `--max-abs-diff` and `--p99-abs-diff`
+    of the reference (on the [0, 1] scale); the benchmark fails otherwise.
+    """
+    image = synthetic_volume(tuple(args.shape), tuple(args.spacing))
+    results = {}
+    outputs = {}
+    for name, fused in (('reference', False), ('fused', True)):
+        # Drop the loader: both chains start from the same in-memory volume.
+        chain = Compose(get_deterministic_transforms({**PREPROCESS_CONFIG, 'fused': fused}).transforms[1:])
+        out, times = _time(lambda: chain({'image': image.clone()})['image'], args.repeats)
+        outputs[name] = torch.as_tensor(out)
+        results[name] = {
+            'mean_seconds': float(np.mean(times)),
+            'min_seconds': float(np.min(times)),
+            'output_shape': list(out.shape),
+            'max_value': float(torch.as_tensor(out).max()),
+        }
+    diff = (outputs['fused'] - outputs['reference']).abs()
+    results['speedup'] = results['reference']['mean_seconds'] / results['fused']['mean_seconds']
+    results['max_abs_diff'] = float(diff.max())
+    results['mean_abs_diff'] = float(diff.mean())
+    results['p99_abs_diff'] = float(torch.quantile(diff.flatten()[::97], 0.99))
+    results['tolerance'] = {'max_abs_diff': args.max_abs_diff, 'p99_abs_diff': args.p99_abs_diff}
+    results['within_tolerance'] = (results['max_abs_diff'] <= args.max_abs_diff
+                                   and results['p99_abs_diff'] <= args.p99_abs_diff)
+    return results
+
+
+def _peak_memory(device):
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    return peak_rss_bytes()
+
+
+def _train_steps(precision, channels_last, shape, batch_size, steps, warmup, seed):
+    """
+    Runs training steps of the model from `create_model` on a fixed synthetic
+    batch. Meant to run in a fresh process so the peak memory is its own.
+    """
+    from monai.losses import DiceLoss
+    from model import create_model
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    check_precision(device, precision)
+    # Same seed, same initial weights and data in every mode.
+    torch.manual_seed(seed)
+    model = to_channels_last(create_model().to(device), channels_last)
+    model.train()
+    loss_function = DiceLoss(to_onehot_y=True, softmax=True)
+    optimizer = torch.optim.Adam(model.parameters(), 1e-4)
+    scaler = grad_scaler(device, precision)
+
+    inputs = torch.rand((batch_size, 1, *shape), device=device)
+    # Bright voxels form the foreground, so the loss has something to learn.
+    labels = (inputs > 0.8).float()
+    inputs = to_channels_last(inputs, channels_last)
+
+    losses, times = [], []
+    for step in range(warmup + steps):
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        with autocast(device, precision):
+            outputs = model(inputs)
+        loss = loss_function(outputs.float(), labels)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+        losses.append(loss.item())
+        if step >= warmup:
+            times.append(time.perf_counter() - start)
+    return {
+        'steps_per_second': len(times) / sum(times),
+        'mean_step_seconds': float(np.mean(times)),
+        'peak_memory_bytes': int(_peak_memory(device)),
+        'losses': losses,
+    }
+
+
+def bench_precision(args):
+    """
+    Compares training throughput, peak memory and loss curves of the precision
+    and memory-layout modes against the fp32 baseline.
+    """
+    results = {'input_shape': [args.batch_size, 1, *args.shape]}
+    context = multiprocessing.get_context('spawn')
+    for mode in args.modes:
+        precision, _, layout = mode.partition('+')
+        # One process per mode: peak RSS never decreases within a process.
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[mode] = pool.submit(_train_steps, precision, layout == 'cl', tuple(args.shape),
+                                        args.batch_size, args.steps, args.warmup, args.seed).result()
+
+    baseline = results.get('fp32')
+    if baseline is not None:
+        for mode in args.modes:
+            if mode == 'fp32':
+                continue
+            results[mode]['speedup'] = results[mode]['steps_per_second'] / baseline['steps_per_second']
+            results[mode]['memory_ratio'] = results[mode]['peak_memory_bytes'] / baseline['peak_memory_bytes']
+            results[mode]['max_loss_diff'] = float(np.max(np.abs(
+                np.asarray(results[mode]['losses']) - np.asarray(baseline['losses']))))
+    return results
+
+
+def _score_windows(image, mode, roi_size, overlap, reduction, repeats, seed):
+    """
+    Scores `image` with randomly initialized weights, either streamed by
+    `SlidingWindowScorer` with a window batch size of `mode`, or with MONAI's
+    `sliding_window_inference` (`mode='monai'`), which materializes the
+    full-resolution logits. Meant to run in a fresh process.
+    """
+    from monai.inferers import sliding_window_inference
+    from model import create_model
+    from sliding_window import SlidingWindowScorer
+
+    torch.manual_seed(seed)
+    model = create_model().eval()
+    scorer = SlidingWindowScorer(roi_size, overlap=overlap, sw_batch_size=1 if mode == 'monai' else int(mode),
+                                 reduction=reduction)
+    if mode == 'monai':
+        def run():
+            with torch.inference_mode():
+                logits = sliding_window_inference(image[None], roi_size, 1, model, overlap=overlap, mode='gaussian')
+            return float(torch.softmax(logits, dim=1)[0, 1].max())
+    else:
+        run = lambda: scorer(model, image)
+
+    score, times = _time(run, repeats)
+    windows = scorer.num_windows(image.shape[1:])
+    return {
+        'windows': windows,
+        'windows_per_second': windows * len(times) / sum(times),
+        'mean_seconds': float(np.mean(times)),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'score': score,
+    }
+
+
+def bench_sliding_window(args):
+    """
+    Measures windows per second and peak RSS of full-resolution sliding-window
+    scoring per window batch size, against MONAI's materializing inferer.
+    """
+    chain = Compose(get_deterministic_transforms(FULL_RESOLUTION_CONFIG).transforms[1:])
+    image = torch.as_tensor(chain({'image': synthetic_volume(tuple(args.shape), tuple(args.spacing))})['image'])
+    results = {'volume_shape': list(image.shape[1:]), 'roi_size': args.roi_size, 'overlap': args.overlap}
+    context = multiprocessing.get_context('spawn')
+    for mode in args.modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[mode] = pool.submit(_score_windows, image, mode, tuple(args.roi_size), args.overlap,
+                                        args.reduction, args.repeats, args.seed).result()
+    return results
+
+
+def bench_cascade(args):
+    """
+    Compares per-series latency of the screen-and-refine cascade with
+    sliding-window scoring of every series at full resolution, and how far
+    the cascade scores drift from the single-stage ones.
+    """
+    from scipy.stats import spearmanr
+    from cascade import CascadeScorer
+    from engine import load_model
+    from model import create_model
+    from sliding_window import SlidingWindowScorer
+
+    torch.manual_seed(args.seed)
+    model = load_model(args.checkpoint) if args.checkpoint else create_model().eval()
+    chain = Compose(get_deterministic_transforms(FULL_RESOLUTION_CONFIG).transforms[1:])
+    images = [torch.as_tensor(chain({'image': synthetic_volume(tuple(args.shape), tuple(args.spacing),
+                                                                seed=args.seed + i)})['image'])
+              for i in range(args.series)]
+
+    refiner = SlidingWindowScorer(tuple(args.roi_size), overlap=args.overlap, reduction=args.reduction)
+    cascade = CascadeScorer(refiner, negative_threshold=args.negative_threshold,
+                            positive_threshold=args.positive_threshold,
+                            candidate_threshold=args.candidate_threshold)
+    single, single_times = [], []
+    staged, staged_times = [], []
+    for image in images:
+        score, times = _time(lambda: refiner(model, image), 1)
+        single.append(score)
+        single_times += times
+        score, times = _time(lambda: cascade(model, image), 1)
+        staged.append(score)
+        staged_times += times
+
+    stats = cascade.stats()
+    # Refined scores land in the band between the thresholds; map them back.
+    low, high = args.negative_threshold, args.positive_threshold
+    refined = [abs((a - low) / (high - low) - b) for a, b in zip(staged, single) if low <= a < high]
+    return {
+        'volume_shape': list(images[0].shape[1:]),
+        'single_stage_seconds_per_series': float(np.mean(single_times)),
+        'cascade_seconds_per_series': float(np.mean(staged_times)),
+        'speedup': float(np.sum(single_times) / np.sum(staged_times)),
+        **stats,
+        # Full-resolution scores of refined series, cascade vs single stage
+        'max_refined_score_diff': float(np.max(refined)) if refined else None,
+        'score_rank_correlation': float(spearmanr(single, staged)[0]) if len(images) > 1 else None,
+        'single_stage_scores': single,
+        'cascade_scores': staged,
+    }
+
+
+def _compiled_calls(mode, shape, batch_size, steps, train, cache_dir, seed):
+    """
+    Times the first call and then `steps` further calls of the model from
+    `create_model`, eager or compiled with artifacts in `cache_dir`. Meant to
+    run in a fresh process, so compilation starts from the on-disk cache only.
+    """
+    from compiled import compile_model
+    from model import create_model
+
+    torch.manual_seed(seed)
+    model = create_model()
+    net = compile_model(model, cache_dir) if mode != 'eager' else model
+    inputs = torch.rand((batch_size, 1, *shape), device=next(model.parameters()).device)
+    if train:
+        model.train()
+        optimizer = torch.optim.Adam(model.parameters(), 1e-4)
+
+        def step():
+            optimizer.zero_grad()
+            net(inputs).float().mean().backward()
+            optimizer.step()
+    else:
+        model.eval()
+
+        def step():
+            with torch.inference_mode():
+                net(inputs)
+
+    _, first = _time(step, 1)
+    _, times = _time(step, steps)
+    return {
+        'first_call_seconds': first[0],
+        'steady_calls_per_second': len(times) / sum(times),
+        'steady_samples_per_second': batch_size * len(times) / sum(times),
+    }
+
+
+def bench_compile(args):
+    """
+    Separates first-call latency (including compilation) from steady-state
+    throughput for eager and compiled models. 'compiled-cold' starts from an
+    empty artifact cache and 'compiled-warm' reuses what it wrote.
+    """
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix='compile_cache_')
+    results = {'input_shape': [args.batch_size, 1, *args.shape], 'train': args.train}
+    context = multiprocessing.get_context('spawn')
+    try:
+        for mode in args.modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[mode] = pool.submit(_compiled_calls, mode, tuple(args.shape), args.batch_size, args.steps,
+                                            args.train, cache_dir, args.seed).result()
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    baseline = results.get('eager')
+    if baseline is not None:
+        for mode in args.modes:
+            if mode != 'eager':
+                results[mode]['steady_speedup'] = (results[mode]['steady_calls_per_second']
+                                                   / baseline['steady_calls_per_second'])
+    return results
+
+
+def write_synthetic_dataset(root, num_volumes, shape, spacing, seed=0):
+    """
+    Writes `num_volumes` synthetic heads as int16 NIfTI files and a label CSV
+    under `root`, laid out like the real data. Returns `(csv_path, nifti_dir)`.
+    """
+    import nibabel as nib
+    import pandas as pd
+
+    nifti_dir = os.path.join(root, 'nifti_files')
+    os.makedirs(nifti_dir, exist_ok=True)
+    uids = [f"synthetic.{i}" for i in range(num_volumes)]
+    for i, uid in enumerate(uids):
+        image = synthetic_volume(shape, spacing, seed=seed + i)
+        nib.save(nib.Nifti1Image(image[0].numpy().astype(np.int16), image.affine.numpy()),
+                 os.path.join(nifti_dir, f"{uid}.nii.gz"))
+    csv_path = os.path.join(root, 'labels.csv')
+    pd.DataFrame({'SeriesInstanceUID': uids, 'Aneurysm Present': np.arange(num_volumes) % 2}).to_csv(
+        csv_path, index=False)
+    return csv_path, nifti_dir
+
+
+def _loader_steps(csv_path, nifti_dir, cache_dir, cache_mode, batch_size, num_workers, steps, warmup, precision,
+                  channels_last, seed):
+    """
+    Runs training steps fed by `create_dataloaders`, timing separately how
+    long each step waits for its batch and how long forward, backward and
+    the optimizer take. Meant to run in a fresh process, so peak RSS and the
+    CPU time of reaped loader workers belong to this run.
+    """
+    from monai.losses import DiceLoss
+    from data_preparation import create_dataloaders, get_data_dicts
+    from model import create_model
+    from rotating_cache import RotatingCacheDataset
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    check_precision(device, precision)
+    torch.manual_seed(seed)
+    loader_kwargs = {'cache_dir': None if cache_mode == 'none' else cache_dir, 'num_workers': num_workers}
+    if cache_mode == 'rotating':
+        loader_kwargs['cache_rate'] = 0.5
+    train_loader, _ = create_dataloaders(get_data_dicts(csv_path, nifti_dir), batch_size=batch_size,
+                                         **loader_kwargs)
+    sample_cache = train_loader.dataset if isinstance(train_loader.dataset, RotatingCacheDataset) else None
+
+    model = to_channels_last(create_model().to(device), channels_last)
+    model.train()
+    loss_function = DiceLoss(to_onehot_y=True, softmax=True)
+    optimizer = torch.optim.Adam(model.parameters(), 1e-4)
+    scaler = grad_scaler(device, precision)
+
+    if sample_cache is not None:
+        sample_cache.start()
+    waits, computes, samples, epochs = [], [], 0, 0
+    hits = misses = 0
+    start = time.perf_counter()
+    step = 0
+    while step < warmup + steps:
+        batches = iter(train_loader)
+        while step < warmup + steps:
+            fetch_start = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                break
+            compute_start = time.perf_counter()
+            inputs = to_channels_last(as_plain_tensor(batch['image']).to(device), channels_last)
+            # Series labels do not fit the segmentation loss; as in the
+            # precision benchmark, bright voxels stand in for the foreground.
+            labels = (inputs > 0.8).float()
+            optimizer.zero_grad()
+            with autocast(device, precision):
+                outputs = model(inputs)
+            loss = loss_function(outputs.float(), labels)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            loss.item()
+            if step >= warmup:
+                waits.append(compute_start - fetch_start)
+                computes.append(time.perf_counter() - compute_start)
+                samples += len(inputs)
+            step += 1
+        # Shuts the workers down, so their CPU time is accounted to us.
+        del batches
+        epochs += 1
+        if sample_cache is not None:
+            stats = sample_cache.update_cache()
+            hits, misses = hits + stats['hits'], misses + stats['misses']
+    wall = time.perf_counter() - start
+    if sample_cache is not None:
+        sample_cache.shutdown()
+
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN)
+    timed = sum(waits) + sum(computes)
+    return {
+        'samples_per_second': samples / timed,
+        'wait_seconds_mean': float(np.mean(waits)),
+        'wait_seconds_max': float(np.max(waits)),
+        'compute_seconds_mean': float(np.mean(computes)),
+        'wait_fraction': sum(waits) / timed,
+        # Busy fraction of the workers over the whole run, warm-up included
+        'worker_utilization': ((workers.ru_utime + workers.ru_stime) / (num_workers * wall)
+                               if num_workers else None),
+        'epochs': epochs,
+        'cache_hit_rate': hits / max(hits + misses, 1) if sample_cache is not None else None,
+        'peak_rss_bytes': peak_rss_bytes(),
+        # Linux reports kilobytes; the largest single worker.
+        'worker_peak_rss_bytes': workers.ru_maxrss * 1024 if num_workers else None,
+    }
+
+
+def bench_training(args):
+    """
+    Sweeps batch size, loader workers and caching mode over training steps,
+    reporting throughput and whether steps wait on the loader or on compute.
+    Runs on synthetic volumes written to a temporary directory, or on the
+    converted data and the shared `./cache` with `--data cached`.
+    """
+    from cache import PersistentVolumeDataset
+    from data_preparation import CSV_PATH, NIFTI_DIR, get_data_dicts
+
+    root = None
+    if args.data == 'synthetic':
+        root = tempfile.mkdtemp(prefix='training_bench_')
+        csv_path, nifti_dir = write_synthetic_dataset(root, args.num_volumes, tuple(args.shape),
+                                                      tuple(args.spacing), args.seed)
+        cache_dir = os.path.join(root, 'cache')
+    else:
+        csv_path, nifti_dir, cache_dir = CSV_PATH, NIFTI_DIR, './cache'
+
+    results = {'data': args.data, 'runs': []}
+    context = multiprocessing.get_context('spawn')
+    try:
+        if any(mode != 'none' for mode in args.cache_modes):
+            # The sweep measures steady-state epochs, so fill the disk cache first.
+            start = time.perf_counter()
+            ds = PersistentVolumeDataset(
+                data=get_data_dicts(csv_path, nifti_dir),
+                deterministic_transform=get_deterministic_transforms(),
+                cache_dir=cache_dir,
+                config=PREPROCESS_CONFIG,
+                storage_dtype='int16',
+                value_range=(PREPROCESS_CONFIG['b_min'], PREPROCESS_CONFIG['b_max']),
+            )
+            for index in range(len(ds)):
+                ds[index]
+            results['cache_fill_seconds'] = time.perf_counter() - start
+
+        for cache_mode, batch_size, num_workers in itertools.product(args.cache_modes, args.batch_sizes,
+                                                                      args.num_workers):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                run = pool.submit(_loader_steps, csv_path, nifti_dir, cache_dir, cache_mode, batch_size,
+                                  num_workers, args.steps, args.warmup, args.precision, args.channels_last,
+                                  args.seed).result()
+            results['runs'].append({'cache_mode': cache_mode, 'batch_size': batch_size,
+                                    'num_workers': num_workers, **run})
+    finally:
+        if root is not None:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+BENCHMARKS = {
+    'preprocess': bench_preprocess,
+    'precision': bench_precision,
+    'sliding-window': bench_sliding_window,
+    'cascade': bench_cascade,
+    'compile': bench_compile,
+    'training': bench_training,
+}
+
+
+def _git_commit():
+    """
+    Commit of the checkout, recorded so results can be compared across commits.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the aneurysm pipeline.")
+    parser.add_argument('--output', default=None, help="Also write the JSON results to this file.")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = sub.add_parser('preprocess', help="Fused vs reference deterministic preprocessing.")
+    p.add_argument('--shape', type=int, nargs=3, default=[512, 512, 160])
+    p.add_argument('--spacing', type=float, nargs=3, default=[0.44, 0.44, 0.6])
+    p.add_argument('--repeats', type=int, default=3)
+    p.add_argument('--max-abs-diff', type=float, default=0.4,
+                   help="Largest allowed voxel difference between the fused and reference outputs.")
+    p.add_argument('--p99-abs-diff', type=float, default=0.1,
+                   help="Allowed 99th percentile of the voxel differences.")
+
+    p = sub.add_parser('precision', help="Mixed-precision and channels-last training steps vs fp32.")
+    p.add_argument('--modes', nargs='+', default=['fp32', 'fp32+cl', 'bf16', 'bf16+cl'],
+                   help="Precision (fp32, bf16, fp16), optionally with '+cl' for channels-last-3d.")
+    p.add_argument('--shape', type=int, nargs=3, default=[128, 128, 128])
+    p.add_argument('--batch-size', type=int, default=1)
+    p.add_argument('--steps', type=int, default=5)
+    p.add_argument('--warmup', type=int, default=1)
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('sliding-window', help="Streamed full-resolution sliding-window scoring.")
+    p.add_argument('--modes', nargs='+', default=['1', '2', '4', 'monai'],
+                   help="Window batch sizes, or 'monai' for MONAI's full-volume sliding_window_inference.")
+    p.add_argument('--shape', type=int, nargs=3, default=[512, 512, 160])
+    p.add_argument('--spacing', type=float, nargs=3, default=[0.44, 0.44, 0.6])
+    p.add_argument('--roi-size', type=int, nargs=3, default=list(PREPROCESS_CONFIG['spatial_size']))
+    p.add_argument('--overlap', type=float, default=0.25)
+    p.add_argument('--reduction', choices=['max', 'topk'], default='max')
+    p.add_argument('--repeats', type=int, default=2)
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('cascade', help="Low-resolution screen plus refinement vs full-resolution scoring.")
+    p.add_argument('--checkpoint', default=None, help="Trained weights; random weights if omitted.")
+    p.add_argument('--series', type=int, default=4)
+    p.add_argument('--shape', type=int, nargs=3, default=[512, 512, 160])
+    p.add_argument('--spacing', type=float, nargs=3, default=[0.44, 0.44, 0.6])
+    p.add_argument('--roi-size', type=int, nargs=3, default=list(PREPROCESS_CONFIG['spatial_size']))
+    p.add_argument('--overlap', type=float, default=0.25)
+    p.add_argument('--reduction', choices=['max', 'topk'], default='max')
+    p.add_argument('--negative-threshold', type=float, default=0.2)
+    p.add_argument('--positive-threshold', type=float, default=0.9)
+    p.add_argument('--candidate-threshold', type=float, default=0.5)
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('compile', help="torch.compile first-call latency and steady-state throughput vs eager.")
+    p.add_argument('--modes', nargs='+', default=['eager', 'compiled-cold', 'compiled-warm'],
+                   choices=['eager', 'compiled-cold', 'compiled-warm'],
+                   help="'compiled-warm' reuses the artifacts 'compiled-cold' wrote; keep that order.")
+    p.add_argument('--shape', type=int, nargs=3, default=[64, 64, 64])
+    p.add_argument('--batch-size', type=int, default=1)
+    p.add_argument('--steps', type=int, default=10)
+    p.add_argument('--train', action='store_true', help="Time training steps instead of inference calls.")
+    p.add_argument('--cache-dir', default=None,
+                   help="Artifact cache to use and keep; a temporary one is used and removed by default.")
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('training', help="Training throughput and loader stalls across loader settings.")
+    p.add_argument('--data', choices=['synthetic', 'cached'], default='synthetic',
+                   help="'cached' uses the converted data and ./cache in the working directory.")
+    p.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2])
+    p.add_argument('--num-workers', type=int, nargs='+', default=[0, 2, 4])
+    p.add_argument('--cache-modes', nargs='+', choices=CACHE_MODES, default=list(CACHE_MODES))
+    p.add_argument('--steps', type=int, default=8)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--precision', choices=PRECISIONS, default='fp32')
+    p.add_argument('--channels-last', action='store_true')
+    p.add_argument('--num-volumes', type=int, default=8, help="Synthetic volumes to write.")
+    p.add_argument('--shape', type=int, nargs=3, default=[256, 256, 128])
+    p.add_argument('--spacing', type=float, nargs=3, default=[0.8, 0.8, 1.0])
+    p.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {'benchmark': args.benchmark, 'commit': _git_commit(), 'torch_threads': torch.get_num_threads(),
+               **BENCHMARKS[args.benchmark](args)}
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if not results.get('within_tolerance', True):
+        sys.exit("Fused preprocessing differs from the reference beyond the tolerance.")
+    sys.exit(0)
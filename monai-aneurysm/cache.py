@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+from monai.data import Dataset
+
+from profiling import Profiler
+from volume_store import STORAGE_DTYPES, decode_volume, encode_volume
+
+# Bump when the on-disk layout or the meaning of a cached array changes.
+CACHE_VERSION = 2
+
+
+def _transform_spec(obj, depth=0):
+    """
+    Describes a (possibly nested) Compose as the list of its transforms, each
+    with its class and constructor state, recursively, so that changing any
+    argument, e.g. an interpolation `mode` or a `select_fn`, changes the spec.
+    Private attributes (random states, lazy flags) are left out.
+    """
+    if hasattr(obj, 'transforms'):
+        return [_transform_spec(t, depth) for t in obj.transforms]
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [_transform_spec(v, depth + 1) for v in obj]
+    if isinstance(obj, dict):
+        return {str(k): _transform_spec(v, depth + 1) for k, v in obj.items()}
+    if isinstance(obj, type) or hasattr(obj, '__qualname__'):
+        # Classes and functions by name, as their repr may hold an address;
+        # functions also by their bytecode and constants, which tell lambdas apart.
+        name = f"{obj.__module__}.{obj.__qualname__}"
+        code = getattr(obj, '__code__', None)
+        if code is None:
+            return name
+        consts = repr([c for c in code.co_consts if not hasattr(c, 'co_code')]).encode()
+        return f"{name}:{hashlib.sha1(code.co_code + consts).hexdigest()[:8]}"
+    if hasattr(obj, 'tolist'):
+        # numpy arrays and scalars, tensors
+        return obj.tolist()
+    if not hasattr(obj, '__dict__') or depth >= 8:
+        # e.g. torch dtypes
+        return str(obj)
+    spec = {'class': type(obj).__qualname__}
+    spec.update({k: _transform_spec(v, depth + 1) for k, v in sorted(vars(obj).items())
+                 if not k.startswith('_')})
+    return spec
+
+
+def transform_hash(config, transform, storage=None):
+    """
+    Hashes the deterministic transform chain with every transform's arguments,
+    the config and the storage format. Any change yields a new key, and
+    therefore a fresh cache directory.
+    """
+    spec = {
+        'version': CACHE_VERSION,
+        'config': config,
+        'transforms': _transform_spec(transform),
+        'storage': storage,
+    }
+    blob = json.dumps(spec, sort_keys=True, default=str).encode()
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+class PersistentVolumeDataset(Dataset):
+    """
+    Dataset that caches the output of the deterministic transform prefix on disk.
+
+    Preprocessed volumes are stored as `.npy` files under
+    `<cache_dir>/<transform hash>/` and read back memory-mapped, so only
+    `transform` (the random augmentations, if any) runs every epoch. The cache
+    directory can be shared by any script that uses the same preprocessing.
+
+    Volumes are kept in `storage_dtype` (see `volume_store.encode_volume`) and
+    converted to float32 in the loader worker. For int16, `value_range` fixes
+    the quantization scale for the whole cache.
+
+    Reads of cached volumes are timed as `cache_read` spans of `profiler`.
+    """
+
+    def __init__(self, data, deterministic_transform, transform=None, cache_dir='./cache', config=None,
+                 storage_dtype='float32', value_range=None, profiler=None):
+        super().__init__(data=data, transform=transform)
+        self.profiler = profiler if profiler is not None else Profiler()
+        if storage_dtype == 'int16' and value_range is None:
+            raise ValueError("int16 cache storage needs a fixed value_range, e.g. (b_min, b_max)")
+        self.deterministic_transform = deterministic_transform
+        self.storage_dtype = storage_dtype
+        self.value_range = tuple(value_range) if value_range is not None else None
+        # With a fixed range every volume shares the same scale and offset.
+        _, self.scale, self.offset = encode_volume(np.zeros(1, np.float32), storage_dtype, self.value_range)
+
+        storage = {'dtype': storage_dtype, 'value_range': self.value_range}
+        self.key = transform_hash(config or {}, deterministic_transform, storage)
+        self.cache_dir = os.path.join(cache_dir, self.key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        spec_path = os.path.join(self.cache_dir, 'config.json')
+        if not os.path.exists(spec_path):
+            with open(spec_path, 'w') as f:
+                json.dump({'config': config, 'transforms': _transform_spec(deterministic_transform),
+                           'storage': storage}, f, indent=2, default=str)
+
+    def _cache_path(self, image_path):
+        name = hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.npy")
+
+    def _reference(self, item):
+        return np.asarray(self.deterministic_transform(item)['image'], dtype=np.float32)
+
+    def _preprocess(self, item, cache_path):
+        stored, _, _ = encode_volume(self._reference(item), self.storage_dtype, self.value_range)
+        # Save under a temporary name and rename, so concurrent workers and
+        # interrupted runs never expose a partially written array.
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, stored)
+        os.replace(tmp_path, cache_path)
+        return stored
+
+    def _load(self, item):
+        cache_path = self._cache_path(item['image'])
+        try:
+            return np.load(cache_path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return self._preprocess(item, cache_path)
+
+    def _transform(self, index):
+        item = dict(self.data[index])
+        # Decoding copies out of the read-only mapping; pages stay shared in
+        # the page cache.
+        with self.profiler.span('cache_read'):
+            item['image'] = decode_volume(self._load(item), self.scale, self.offset)
+        return self.transform(item) if self.transform is not None else item
+
+    def verify(self):
+        """
+        Recomputes each sample in float32 and compares it with the cached copy.
+        Returns one record per sample with its maximum quantization error.
+        """
+        report = []
+        for index in range(len(self.data)):
+            item = dict(self.data[index])
+            cached = self._load(item)
+            error = np.abs(decode_volume(cached, self.scale, self.offset) - self._reference(item))
+            report.append({
+                'image': item['image'],
+                'max_abs_error': float(error.max()),
+                'stored_bytes': int(cached.nbytes),
+                'float32_bytes': int(cached.size * 4),
+            })
+        return report
+
+
+if __name__ == '__main__':
+    from data_preparation import CSV_PATH, NIFTI_DIR, PREPROCESS_CONFIG, get_data_dicts, get_deterministic_transforms
+
+    parser = argparse.ArgumentParser(description="Report the per-series quantization error of the preprocessed-volume cache.")
+    parser.add_argument('--csv-path', default=CSV_PATH)
+    parser.add_argument('--nifti-dir', default=NIFTI_DIR)
+    parser.add_argument('--cache-dir', default='./cache')
+    parser.add_argument('--storage-dtype', default='int16', choices=STORAGE_DTYPES)
+    args = parser.parse_args()
+
+    ds = PersistentVolumeDataset(
+        data=get_data_dicts(args.csv_path, args.nifti_dir),
+        deterministic_transform=get_deterministic_transforms(),
+        cache_dir=args.cache_dir,
+        config=PREPROCESS_CONFIG,
+        storage_dtype=args.storage_dtype,
+        value_range=(PREPROCESS_CONFIG['b_min'], PREPROCESS_CONFIG['b_max']),
+    )
+    report = ds.verify()
+    for record in report:
+        print(f"{os.path.basename(record['image'])}: max abs error {record['max_abs_error']:.3g}")
+    if report:
+        stored = sum(r['stored_bytes'] for r in report)
+        full = sum(r['float32_bytes'] for r in report)
+        print(f"Worst series error: {max(r['max_abs_error'] for r in report):.3g}; "
+              f"cache size {stored / 2**20:.1f} MiB vs {full / 2**20:.1f} MiB as float32.")
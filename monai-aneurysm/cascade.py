@@ -0,0 +1,96 @@
+import math
+
+import torch
+import torch.nn.functional as F
+from monai.data import MetaTensor
+
+from data_preparation import PREPROCESS_CONFIG
+from sliding_window import SlidingWindowScorer, _model_device
+
+
+class CascadeScorer:
+    """
+    Two-stage scoring of full-resolution volumes: a cheap low-resolution
+    screen, then sliding-window refinement only where it is needed.
+
+    The screener sees the volume resized to `screen_size`, the size the model
+    was trained on, and gives a probability map and a series score (reduced
+    like the refiner's). A series scoring below `negative_threshold` or from
+    `positive_threshold` up keeps its screen score. Every other series goes
+    to `refiner`, a `SlidingWindowScorer`, at full resolution. Only the
+    windows covering a voxel whose screen probability reaches
+    `candidate_threshold` are run, or the whole volume if no voxel does.
+
+    The two stages score on different scales, so a refined score is mapped
+    linearly into `[negative_threshold, positive_threshold)`: series settled
+    by the screen stay ranked below or above every refined one, and refined
+    series keep the order of their full-resolution scores.
+
+    `stats()` counts the series that were screened out and the full-resolution
+    windows skipped, compared with refining every series in full.
+    """
+
+    def __init__(self, refiner=None, screen_size=PREPROCESS_CONFIG['spatial_size'], negative_threshold=0.2,
+                 positive_threshold=0.9, candidate_threshold=0.5):
+        if not negative_threshold <= positive_threshold:
+            raise ValueError("negative_threshold must not exceed positive_threshold")
+        self.refiner = refiner if refiner is not None else SlidingWindowScorer()
+        self.screen_size = tuple(int(s) for s in screen_size)
+        self.negative_threshold = negative_threshold
+        self.positive_threshold = positive_threshold
+        self.candidate_threshold = candidate_threshold
+        self._stats = {'series': 0, 'screened_negative': 0, 'screened_positive': 0, 'refined': 0,
+                       'windows_run': 0, 'windows_total': 0}
+
+    def input_shapes(self):
+        """
+        Batch shapes the models are called with: the screen, then the refiner's.
+        """
+        return [(1, 1, *self.screen_size)] + self.refiner.input_shapes()
+
+    def screen(self, model, image):
+        """
+        Returns the low-resolution aneurysm probability map of a `(1, D, H, W)` volume.
+        """
+        x = (image.as_tensor() if isinstance(image, MetaTensor) else torch.as_tensor(image)).float()
+        low = F.interpolate(x[None], size=self.screen_size, mode='trilinear', align_corners=False)
+        with torch.inference_mode():
+            return torch.softmax(model(low.to(_model_device(model))).float(), dim=1)[0, 1].cpu()
+
+    def __call__(self, screener, image, refiner=None):
+        """
+        Returns the score of a channel-first `(1, D, H, W)` full-resolution
+        volume. `screener` and `refiner` are the models of the two stages;
+        the screener refines too unless a separate model is given.
+        """
+        shape = image.shape[1:]
+        probs = self.screen(screener, image)
+        score = self.refiner.reduce(probs)
+        self._stats['series'] += 1
+        self._stats['windows_total'] += self.refiner.num_windows(shape)
+
+        if score < self.negative_threshold:
+            self._stats['screened_negative'] += 1
+            return score
+        if score >= self.positive_threshold:
+            self._stats['screened_positive'] += 1
+            return score
+
+        candidates = probs >= self.candidate_threshold
+        refiner = refiner if refiner is not None else screener
+        refined = self.refiner(refiner, image, mask=candidates if candidates.any() else None)
+        self._stats['refined'] += 1
+        self._stats['windows_run'] += self.refiner.windows_run
+        # The band is half-open: a refined 1.0 stays below every screened positive.
+        upper = math.nextafter(self.positive_threshold, -math.inf)
+        return min(self.negative_threshold + (upper - self.negative_threshold) * refined, upper)
+
+    def stats(self):
+        """
+        Returns the counters, with the fraction of series and of
+        full-resolution windows that refinement skipped.
+        """
+        stats = dict(self._stats)
+        stats['series_skipped'] = 1 - stats['refined'] / max(stats['series'], 1)
+        stats['windows_skipped'] = 1 - stats['windows_run'] / max(stats['windows_total'], 1)
+        return stats
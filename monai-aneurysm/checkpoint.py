@@ -0,0 +1,137 @@
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+from monai.transforms import Transform
+
+LAST_CHECKPOINT = 'last.pth'
+
+
+def _transform_states(transform, found=None):
+    """
+    Collects the random states of every transform reachable from `transform`,
+    in a fixed order (the same walk as `monai.data.utils.set_rnd`).
+    """
+    found = [] if found is None else found
+    if isinstance(transform, (list, tuple)):
+        for t in transform:
+            _transform_states(t, found)
+        return found
+    if not isinstance(transform, Transform):
+        return found
+    if isinstance(getattr(transform, 'R', None), np.random.RandomState):
+        found.append(transform.R)
+    for key, value in vars(transform).items():
+        if key != 'R':
+            _transform_states(value, found)
+    return found
+
+
+def rng_state(transform=None):
+    """
+    Captures the Python, NumPy and torch generators, plus the random state of
+    the augmentations in `transform` (they advance in the main process when
+    the loader has no workers).
+    """
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        'transforms': [R.get_state() for R in _transform_states(transform)],
+    }
+
+
+def set_rng_state(state, transform=None):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    for R, R_state in zip(_transform_states(transform), state['transforms']):
+        R.set_state(R_state)
+
+
+def snapshot_state(obj):
+    """
+    Copies every tensor to CPU memory, so training can keep updating the
+    originals while the copy is written out.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot_state(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_state(v) for v in obj)
+    return obj
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints from a background thread.
+
+    `save()` only takes an in-memory snapshot of the state (a copy of each
+    tensor) and returns; the thread serializes it to a temporary file, fsyncs
+    it and renames it into place, so a crash never leaves a truncated
+    checkpoint under the final name. Write errors are raised by the next
+    `save()` or by `close()`.
+    """
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            state, path = job
+            try:
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    torch.save(state, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def save(self, state, name):
+        """
+        Queues `state` to be written to `<checkpoint_dir>/<name>`.
+        """
+        self._raise_error()
+        self._queue.put((snapshot_state(state), os.path.join(self.checkpoint_dir, name)))
+
+    def wait(self):
+        """
+        Blocks until every queued checkpoint is on disk.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+
+def load_checkpoint(path, device='cpu'):
+    # Full training state holds NumPy RNG state, not just tensors.
+    return torch.load(path, map_location=device, weights_only=False)
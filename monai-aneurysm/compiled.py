@@ -0,0 +1,60 @@
+import os
+import time
+
+import torch
+
+from precision import autocast, to_channels_last
+
+# Compiled kernels and graphs, reused by later processes
+COMPILE_CACHE_DIR = './compile_cache'
+
+
+def enable_compile_cache(cache_dir=COMPILE_CACHE_DIR):
+    """
+    Keeps compilation artifacts (generated kernels and FX graphs) under
+    `cache_dir`, so a later process start loads them instead of compiling
+    again. Takes effect for models compiled afterwards, here and in processes
+    spawned from here.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = cache_dir
+    torch._inductor.config.fx_graph_cache = True
+    return cache_dir
+
+
+def compile_model(model, cache_dir=COMPILE_CACHE_DIR, mode=None):
+    """
+    Wraps a `create_model()` model with `torch.compile`, caching artifacts in
+    `cache_dir`. Compilation happens on the first call for each input shape,
+    so call `warm_up()` first where startup time is cheaper than a slow
+    first request.
+
+    The wrapper shares its parameters with `model`; save and load state
+    dicts through `model`, since the wrapper prefixes every key.
+    """
+    enable_compile_cache(cache_dir)
+    return torch.compile(model, mode=mode)
+
+
+def warm_up(model, shapes, device=None, precision='fp32', channels_last=False):
+    """
+    Runs `model` in eval mode on a zero batch of each `(B, C, D, H, W)` shape
+    in `shapes`, under inference mode and the autocast and memory-layout
+    settings used for inference, so a compiled model is ready for those
+    shapes. Returns the seconds each call took.
+
+    Compiled graphs are specialized on the grad mode, so callers should run
+    the model under `torch.inference_mode()` too.
+    """
+    device = device if device is not None else torch.device('cpu')
+    model.eval()
+    seconds = []
+    for shape in shapes:
+        # Created outside inference mode, like the batches a loader yields.
+        inputs = to_channels_last(torch.zeros(shape, device=device), channels_last)
+        start = time.perf_counter()
+        with torch.inference_mode(), autocast(device, precision):
+            model(inputs)
+        seconds.append(time.perf_counter() - start)
+    return seconds
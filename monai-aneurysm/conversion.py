@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+# Define paths
+CSV_PATH = 'merged_medical_data.csv'
+DICOM_DIR = 'aneurysm-mm-keras/train'
+NIFTI_DIR = 'nifti_files'
+MANIFEST_DIRNAME = '_manifest'
+
+# Output file suffix per storage format.
+OUTPUT_SUFFIX = {
+    'nifti': '.nii.gz',
+    'chunked': '.vol',
+}
+
+STATUS_IN_PROGRESS = 'in_progress'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def _default_shard():
+    """
+    Reads the shard layout from the HPC job-array environment, if any.
+    """
+    if 'SLURM_ARRAY_TASK_ID' in os.environ:
+        # Arrays may be declared as 1-N; shards are always counted from zero.
+        index = int(os.environ['SLURM_ARRAY_TASK_ID']) - int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+        return index, int(os.environ.get('SLURM_ARRAY_TASK_COUNT', 1))
+    return 0, 1
+
+
+def shard_series(series_ids, shard_index, num_shards):
+    """
+    Deterministically assigns series to a shard so every job-array worker
+    gets a disjoint slice of the same sorted list.
+    """
+    return sorted(series_ids)[shard_index::num_shards]
+
+
+class ConversionManifest:
+    """
+    Append-only JSON-lines record of the conversion state of each series.
+
+    Each shard writes its own file under `<nifti_dir>/_manifest`, so job-array
+    workers never contend for the same file. Reading the manifest merges every
+    shard file and keeps the most recent record per series.
+    """
+
+    def __init__(self, nifti_dir, shard_index=0):
+        self.manifest_dir = os.path.join(nifti_dir, MANIFEST_DIRNAME)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self.path = os.path.join(self.manifest_dir, f"shard-{shard_index:04d}.jsonl")
+        self.error_log_path = os.path.join(self.manifest_dir, f"errors-{shard_index:04d}.jsonl")
+
+    def load(self):
+        """
+        Returns a mapping of series id to its latest manifest record.
+        """
+        state = {}
+        for name in sorted(os.listdir(self.manifest_dir)):
+            if not (name.startswith('shard-') and name.endswith('.jsonl')):
+                continue
+            with open(os.path.join(self.manifest_dir, name)) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A worker killed mid-write leaves a truncated last line.
+                        continue
+                    previous = state.get(record['series_id'])
+                    if previous is None or record['time'] >= previous['time']:
+                        state[record['series_id']] = record
+        return state
+
+    def record(self, series_id, status, **extra):
+        entry = {'series_id': series_id, 'status': status, 'time': time.time(), **extra}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+
+    def log_error(self, series_id, error):
+        with open(self.error_log_path, 'a') as f:
+            f.write(json.dumps({'series_id': series_id, 'time': time.time(), **error}) + '\n')
+
+
+def _write_nifti(dicom_path, tmp_path):
+    import dicom2nifti
+    dicom2nifti.dicom_series_to_nifti(dicom_path, tmp_path, reorient_nifti=True)
+    return {}
+
+
+def _write_chunked(dicom_path, tmp_path):
+    from dicom_io import load_dicom_series
+    from volume_store import decode_volume, encode_volume, write_volume
+    volume, affine = load_dicom_series(dicom_path)
+    # HU values are integers, so int16 storage is usually lossless; the error
+    # is recorded either way so it can be checked per series.
+    stored, scale, offset = encode_volume(volume, 'int16')
+    error = float(np.max(np.abs(decode_volume(stored, scale, offset) - volume)))
+    write_volume(tmp_path, stored, affine, scale=scale, offset=offset)
+    return {'max_quantization_error': error}
+
+
+_WRITERS = {
+    'nifti': _write_nifti,
+    'chunked': _write_chunked,
+}
+
+
+def _convert_series(series_id, dicom_dir, out_dir, output_format='nifti'):
+    """
+    Worker entry point: converts one series and reports the outcome instead of
+    raising, so a single bad series never takes the pool down.
+    """
+    dicom_path = os.path.join(dicom_dir, series_id)
+    suffix = OUTPUT_SUFFIX[output_format]
+    out_path = os.path.join(out_dir, f"{series_id}{suffix}")
+    # Write under a temporary name so an interrupted run never leaves a
+    # truncated file that looks finished.
+    tmp_path = os.path.join(out_dir, f".{series_id}.{os.getpid()}.tmp{suffix}")
+    start = time.perf_counter()
+    try:
+        info = _WRITERS[output_format](dicom_path, tmp_path)
+        os.replace(tmp_path, out_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return {
+            'series_id': series_id,
+            'ok': False,
+            'error_type': type(e).__name__,
+            'message': str(e),
+            'traceback': traceback.format_exc(),
+            'pid': os.getpid(),
+            'seconds': time.perf_counter() - start,
+        }
+    return {
+        'series_id': series_id,
+        'ok': True,
+        'path': out_path,
+        'seconds': time.perf_counter() - start,
+        **info,
+    }
+
+
+def _init_worker():
+    # One conversion per core: keep numerical libraries from oversubscribing.
+    # The variables only reach libraries loaded from here on; numpy's BLAS
+    # (and torch, if the parent imported it) are already loaded, so their
+    # thread pools are resized at runtime.
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = '1'
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(1)
+
+
+def convert_all(series_ids, dicom_dir, nifti_dir, num_workers=None,
+                shard_index=0, num_shards=1, retry_failed=False, output_format='nifti'):
+    """
+    Converts DICOM series to NIfTI (or, with `output_format='chunked'`, to
+    chunked volume files) with a process pool, resuming from the manifest.
+    Returns a summary dict with done/failed/skipped counts.
+    """
+    os.makedirs(nifti_dir, exist_ok=True)
+    manifest = ConversionManifest(nifti_dir, shard_index)
+    state = manifest.load()
+
+    todo = []
+    skipped = 0
+    for series_id in shard_series(series_ids, shard_index, num_shards):
+        if not os.path.isdir(os.path.join(dicom_dir, series_id)):
+            continue
+        status = state.get(series_id, {}).get('status')
+        if status == STATUS_FAILED and not retry_failed:
+            skipped += 1
+            continue
+        if os.path.exists(os.path.join(nifti_dir, f"{series_id}{OUTPUT_SUFFIX[output_format]}")):
+            # Outputs are only ever renamed into place once complete.
+            if status != STATUS_DONE:
+                manifest.record(series_id, STATUS_DONE)
+            skipped += 1
+            continue
+        # Anything left `in_progress` was interrupted and is simply redone.
+        todo.append(series_id)
+
+    summary = {'done': 0, 'failed': 0, 'skipped': skipped, 'total': len(todo) + skipped}
+    if not todo:
+        return summary
+
+    num_workers = num_workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker) as pool:
+        futures = {}
+        for series_id in todo:
+            manifest.record(series_id, STATUS_IN_PROGRESS)
+            futures[pool.submit(_convert_series, series_id, dicom_dir, nifti_dir, output_format)] = series_id
+
+        for future in as_completed(futures):
+            series_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. OOM-killed).
+                result = {'series_id': series_id, 'ok': False, 'error_type': type(e).__name__,
+                          'message': str(e), 'traceback': traceback.format_exc()}
+
+            if result['ok']:
+                manifest.record(series_id, STATUS_DONE,
+                                **{k: v for k, v in result.items() if k not in ('series_id', 'ok', 'path')})
+                summary['done'] += 1
+            else:
+                manifest.record(series_id, STATUS_FAILED, error_type=result['error_type'])
+                manifest.log_error(series_id, {k: v for k, v in result.items() if k not in ('series_id', 'ok')})
+                summary['failed'] += 1
+
+    summary['seconds'] = time.perf_counter() - start
+    summary['series_per_second'] = len(todo) / summary['seconds']
+    return summary
+
+
+def parse_args(argv=None):
+    shard_index, num_shards = _default_shard()
+    parser = argparse.ArgumentParser(description="Parallel, resumable DICOM conversion.")
+    parser.add_argument('--csv-path', default=CSV_PATH)
+    parser.add_argument('--dicom-dir', default=DICOM_DIR)
+    parser.add_argument('--nifti-dir', default=NIFTI_DIR,
+                        help="Output directory.")
+    parser.add_argument('--format', dest='output_format', choices=sorted(OUTPUT_SUFFIX), default='nifti',
+                        help="Write NIfTI files or chunked volume files for ROI reads.")
+    parser.add_argument('--num-workers', type=int, default=None,
+                        help="Worker processes (default: all cores).")
+    parser.add_argument('--shard-index', type=int, default=shard_index,
+                        help="Shard handled by this job (default: $SLURM_ARRAY_TASK_ID).")
+    parser.add_argument('--num-shards', type=int, default=num_shards,
+                        help="Total shards (default: $SLURM_ARRAY_TASK_COUNT).")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Retry series previously recorded as failed.")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    series_ids = pd.read_csv(args.csv_path, usecols=['SeriesInstanceUID'])['SeriesInstanceUID'].unique()
+
+    print(f"Converting DICOM to NIfTI (shard {args.shard_index + 1}/{args.num_shards})...")
+    summary = convert_all(
+        series_ids, args.dicom_dir, args.nifti_dir,
+        num_workers=args.num_workers,
+        shard_index=args.shard_index,
+        num_shards=args.num_shards,
+        retry_failed=args.retry_failed,
+        output_format=args.output_format,
+    )
+    print(f"Converted: {summary['done']}, failed: {summary['failed']}, skipped: {summary['skipped']}")
+    if summary['failed']:
+        print(f"See {os.path.join(args.nifti_dir, MANIFEST_DIRNAME)} for the error log.")
+        sys.exit(1)
@@ -0,0 +1,151 @@
+import weakref
+from collections.abc import Sequence
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _pack(values):
+    """
+    Stores strings as fixed-width UTF-8 bytes (one byte per ASCII character)
+    and everything else as a plain NumPy array. Neither holds Python objects.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in ('U', 'O'):
+        return np.char.encode(values.astype(np.str_), 'utf-8')
+    return values
+
+
+def _unpack(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _release(blocks):
+    for shm in blocks:
+        try:
+            shm.close()
+        except BufferError:
+            # Still mapped by live arrays (e.g. at interpreter exit); the
+            # mapping goes away with the process.
+            pass
+        shm.unlink()
+
+
+def _attach(name):
+    try:
+        # Python >= 3.13: the creating process alone owns the block.
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class DataIndex(Sequence):
+    """
+    Columnar index of the dataset: one flat NumPy array per field instead of a
+    list of Python dicts. A dict is only built for the sample being accessed,
+    so MONAI datasets can consume it like the list they used to receive.
+
+    The index holds no per-sample Python objects, so forked loader workers do
+    not touch (and copy) its pages through refcount updates. After `share()`
+    the columns live in shared memory and workers started with spawn or
+    forkserver attach to them instead of receiving a pickled copy.
+
+    Extra keyword columns (per-series metadata) are added to each sample dict.
+    """
+
+    def __init__(self, series_uid, image, label, **metadata):
+        self._columns = {
+            'series_uid': _pack(series_uid),
+            'image': _pack(image),
+            'label': np.asarray(label, dtype=np.int64),
+        }
+        for name, values in metadata.items():
+            self._columns[name] = _pack(values)
+        self._shm = []
+        self._owner = False
+
+    @property
+    def series_uid(self):
+        return np.char.decode(self._columns['series_uid'], 'utf-8')
+
+    @property
+    def image(self):
+        return np.char.decode(self._columns['image'], 'utf-8')
+
+    @property
+    def label(self):
+        return self._columns['label']
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def __len__(self):
+        return len(self._columns['label'])
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return {name: _unpack(column[index]) for name, column in self._columns.items()
+                    if name != 'series_uid'}
+        return self.subset(index)
+
+    def subset(self, indices):
+        """
+        Returns a new (unshared) index holding only the given rows (slice, mask or positions).
+        """
+        columns = {name: column[indices] for name, column in self._columns.items()}
+        return DataIndex(**columns)
+
+    def concat(self, other):
+        """
+        Returns a new (unshared) index with the rows of `other`, which has the same columns, appended.
+        """
+        columns = {name: np.concatenate([column, other._columns[name]]) for name, column in self._columns.items()}
+        return DataIndex(**columns)
+
+    def share(self):
+        """
+        Moves the columns into shared memory blocks owned by this process.
+        Call `close()` when done to release them.
+        """
+        if self._shm:
+            return self
+        for name, column in self._columns.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(column.nbytes, 1))
+            shared = np.ndarray(column.shape, dtype=column.dtype, buffer=shm.buf)
+            shared[...] = column
+            self._columns[name] = shared
+            self._shm.append((name, shm))
+        self._owner = True
+        # Unlink the blocks even if close() is never called.
+        self._finalizer = weakref.finalize(self, _release, [shm for _, shm in self._shm])
+        return self
+
+    def close(self):
+        """
+        Copies the columns back into private memory and releases the shared blocks.
+        """
+        self._columns.update({name: np.array(self._columns[name]) for name, _ in self._shm})
+        if self._owner:
+            self._finalizer()
+        else:
+            for _, shm in self._shm:
+                shm.close()
+        self._shm = []
+        self._owner = False
+
+    def __getstate__(self):
+        if not self._shm:
+            return {'columns': self._columns}
+        return {'shared': [(name, shm.name, self._columns[name].dtype.str, self._columns[name].shape)
+                           for name, shm in self._shm]}
+
+    def __setstate__(self, state):
+        self._columns, self._shm, self._owner = {}, [], False
+        if 'columns' in state:
+            self._columns = state['columns']
+            return
+        for name, shm_name, dtype, shape in state['shared']:
+            shm = _attach(shm_name)
+            self._columns[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            self._shm.append((name, shm))
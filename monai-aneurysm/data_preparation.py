@@ -1,11 +1,12 @@
 import os
+import multiprocessing
 import pandas as pd
 import numpy as np
+import torch
+import torch.nn.functional as F
 from sklearn.model_selection import train_test_split
 from monai.transforms import (
     Compose,
-    LoadImaged,
-    EnsureChannelFirstd,
     Spacingd,
     ScaleIntensityRanged,
     CropForegroundd,
@@ -15,11 +16,20 @@ from monai.transforms import (
     RandZoomd,
     EnsureTyped,
 )
-from monai.data import Dataset, DataLoader
+from monai.data import Dataset, DataLoader, list_data_collate
+from torch.utils.data.distributed import DistributedSampler
 import nibabel as nib
 import dicom2nifti
 import pydicom
 
+from cache import PersistentVolumeDataset
+from rotating_cache import RotatingCacheDataset
+from data_index import DataIndex
+from dicom_io import LoadVolumed
+from fused_transforms import FusedResampleCropResized
+from conversion import convert_all
+from profiling import Profiler
+
 # Define paths
 CSV_PATH = 'merged_medical_data.csv'
 # Assuming the DICOM files are in a directory named 'train'
@@ -44,77 +54,233 @@ def convert_dicom_to_nifti(patient_id, dicom_dir, nifti_dir):
             return None
     return nifti_path
 
-def get_data_dicts(csv_path, nifti_dir):
+def _scan_series(nifti_dir, dicom_dir=None, suffix='.nii.gz'):
     """
-    Prepares data dictionaries for MONAI Dataset.
+    Lists the series available on disk with a single directory scan.
     """
-    df = pd.read_csv(csv_path)
-    # The 'Aneurysm Present' column is our label
-    df = df[['SeriesInstanceUID', 'Aneurysm Present']].drop_duplicates()
-
-    data_dicts = []
-    for _, row in df.iterrows():
-        patient_id = row['SeriesInstanceUID']
-        nifti_path = os.path.join(nifti_dir, f"{patient_id}.nii.gz")
-        if os.path.exists(nifti_path):
-            data_dicts.append({
-                'image': nifti_path,
-                'label': np.int64(row['Aneurysm Present'])
-            })
-    return data_dicts
-
-def create_dataloaders(data_dicts, batch_size=1, validation_split=0.2):
+    if dicom_dir is not None:
+        with os.scandir(dicom_dir) as entries:
+            return [e.name for e in entries if e.is_dir() and not e.name.startswith('.')]
+    with os.scandir(nifti_dir) as entries:
+        # Skip hidden files, such as in-flight conversions.
+        return [e.name[:-len(suffix)] for e in entries
+                if e.name.endswith(suffix) and not e.name.startswith('.')]
+
+def get_data_dicts(csv_path, nifti_dir, dicom_dir=None, suffix='.nii.gz'):
     """
-    Creates training and validation dataloaders.
+    Prepares the data index for MONAI Dataset.
+
+    Reads only the label columns, scans the image directory once and joins the
+    two. If `dicom_dir` is given, images point at the `<SeriesInstanceUID>/`
+    DICOM directories and are read directly, skipping the NIfTI round trip.
+    Use `suffix='.vol'` to index a directory of chunked volume files.
     """
-    train_files, val_files = train_test_split(data_dicts, test_size=validation_split, random_state=42)
+    # The 'Aneurysm Present' column is our label
+    df = pd.read_csv(csv_path, usecols=['SeriesInstanceUID', 'Aneurysm Present']).drop_duplicates()
+    df = df[df['SeriesInstanceUID'].isin(_scan_series(nifti_dir, dicom_dir, suffix))]
 
-    # Define transforms
-    train_transforms = Compose([
-        LoadImaged(keys=['image']),
-        EnsureChannelFirstd(keys=['image']),
-        Spacingd(keys=['image'], pixdim=(1.0, 1.0, 1.0), mode='bilinear'),
-        ScaleIntensityRanged(keys=['image'], a_min=-1000, a_max=1000, b_min=0.0, b_max=1.0, clip=True),
+    if dicom_dir is not None:
+        image_paths = dicom_dir + os.sep + df['SeriesInstanceUID']
+    else:
+        image_paths = nifti_dir + os.sep + df['SeriesInstanceUID'] + suffix
+
+    return DataIndex(
+        series_uid=df['SeriesInstanceUID'].to_numpy(),
+        image=image_paths.to_numpy(),
+        label=df['Aneurysm Present'].to_numpy(),
+    )
+
+# Parameters of the deterministic preprocessing stage. The persistent cache is
+# keyed by a hash of these, so changing any value invalidates cached volumes.
+PREPROCESS_CONFIG = {
+    'pixdim': (1.0, 1.0, 1.0),
+    'a_min': -1000,
+    'a_max': 1000,
+    'b_min': 0.0,
+    'b_max': 1.0,
+    'spatial_size': (128, 128, 128),
+    # Resample, crop and resize in one interpolation pass instead of the
+    # Spacingd -> CropForegroundd -> Resized chain.
+    'fused': True,
+}
+
+# Same preprocessing without the final resize: volumes stay at `pixdim`, for
+# sliding-window inference.
+FULL_RESOLUTION_CONFIG = {**PREPROCESS_CONFIG, 'spatial_size': None}
+
+def get_deterministic_transforms(config=PREPROCESS_CONFIG):
+    """
+    Returns the deterministic preprocessing prefix shared by training and validation.
+
+    A `spatial_size` of None skips the resize (see `FULL_RESOLUTION_CONFIG`).
+    """
+    if config.get('fused'):
+        return Compose([
+            LoadVolumed(keys=['image']),
+            FusedResampleCropResized(keys=['image'], pixdim=config['pixdim'],
+                                     spatial_size=config['spatial_size'], threshold=config['a_min']),
+            ScaleIntensityRanged(keys=['image'], a_min=config['a_min'], a_max=config['a_max'],
+                                 b_min=config['b_min'], b_max=config['b_max'], clip=True),
+        ])
+    transforms = [
+        LoadVolumed(keys=['image']),
+        Spacingd(keys=['image'], pixdim=config['pixdim'], mode='bilinear'),
+        ScaleIntensityRanged(keys=['image'], a_min=config['a_min'], a_max=config['a_max'],
+                             b_min=config['b_min'], b_max=config['b_max'], clip=True),
         CropForegroundd(keys=['image'], source_key='image'),
-        Resized(keys=['image'], spatial_size=(128, 128, 128)),
+    ]
+    if config['spatial_size'] is not None:
+        transforms.append(Resized(keys=['image'], spatial_size=config['spatial_size']))
+    return Compose(transforms)
+
+def get_random_transforms():
+    """
+    Returns the random augmentations applied to training samples every epoch.
+    """
+    return Compose([
         RandFlipd(keys=['image'], prob=0.5, spatial_axis=0),
         RandRotated(keys=['image'], prob=0.5, range_x=0.1, range_y=0.1, range_z=0.1),
         RandZoomd(keys=['image'], prob=0.5, min_zoom=0.9, max_zoom=1.1),
-        EnsureTyped(keys=['image', 'label']),
     ])
 
-    val_transforms = Compose([
-        LoadImaged(keys=['image']),
-        EnsureChannelFirstd(keys=['image']),
-        Spacingd(keys=['image'], pixdim=(1.0, 1.0, 1.0), mode='bilinear'),
-        ScaleIntensityRanged(keys=['image'], a_min=-1000, a_max=1000, b_min=0.0, b_max=1.0, clip=True),
-        CropForegroundd(keys=['image'], source_key='image'),
-        Resized(keys=['image'], spatial_size=(128, 128, 128)),
-        EnsureTyped(keys=['image', 'label']),
-    ])
+def pad_collate(batch, pad_value=PREPROCESS_CONFIG['b_min']):
+    """
+    Collates samples of different spatial shapes, e.g. full-resolution
+    volumes, by padding each image with `pad_value` at the far end of every
+    axis up to the largest in the batch. `image_shape` holds each sample's
+    spatial shape before padding.
+    """
+    shapes = np.array([item['image'].shape[1:] for item in batch])
+    target = shapes.max(axis=0)
+    for item, shape in zip(batch, shapes):
+        pad = target - shape
+        if pad.any():
+            item['image'] = F.pad(item['image'], [p for n in reversed(pad) for p in (0, int(n))], value=pad_value)
+    collated = list_data_collate(batch)
+    collated['image_shape'] = torch.as_tensor(shapes)
+    return collated
+
+def create_dataloaders(data_dicts, batch_size=1, validation_split=0.2, cache_dir=None, storage_dtype='int16',
+                       num_workers=4, persistent_workers=False, pin_memory=None, prefetch_factor=2,
+                       cache_rate=None, replace_rate=0.25, distributed=False, config=PREPROCESS_CONFIG,
+                       profiler=None, collate_fn=list_data_collate, extra_validation=None):
+    """
+    Creates training and validation dataloaders from a `DataIndex`.
+
+    If `cache_dir` is given, the output of the deterministic transforms is
+    cached on disk in `storage_dtype` and only the random augmentations run
+    every epoch. With `cache_rate` as well, the training set is served from a
+    `RotatingCacheDataset` holding that fraction of the volumes in RAM and
+    replacing `replace_rate` of them per epoch; call its `start()` before and
+    `update_cache()` after each epoch.
+
+    With `distributed`, both loaders shard their dataset across the processes
+    of the default process group; call `train_loader.sampler.set_epoch(epoch)`
+    to reshuffle each epoch.
+
+    `config` parameterizes the deterministic preprocessing; volumes from
+    `FULL_RESOLUTION_CONFIG` vary in shape, so batch them with
+    `collate_fn=pad_collate` (or use `batch_size=1`).
+
+    With an enabled `Profiler`, every transform stage, cache read and
+    collation is timed, in the loader workers too.
 
-    # Create datasets and dataloaders
-    train_ds = Dataset(data=train_files, transform=train_transforms)
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True, num_workers=4)
+    A `DataIndex` of `extra_validation` series, e.g. labeled series the
+    training index leaves out, is appended to the validation split.
 
-    val_ds = Dataset(data=val_files, transform=val_transforms)
-    val_loader = DataLoader(val_ds, batch_size=batch_size, num_workers=4)
+    The remaining arguments configure both loaders; `pin_memory` defaults to
+    whether CUDA is available.
+    """
+    profiler = profiler if profiler is not None else Profiler()
+    if cache_rate is not None and (cache_dir is None or persistent_workers):
+        raise ValueError("cache_rate needs a cache_dir and non-persistent workers")
+
+    train_idx, val_idx = train_test_split(np.arange(len(data_dicts)), test_size=validation_split, random_state=42)
+    train_files, val_files = data_dicts[train_idx], data_dicts[val_idx]
+    if extra_validation is not None:
+        val_files = val_files.concat(extra_validation)
+    if num_workers > 0 and multiprocessing.get_start_method() != 'fork':
+        # Spawned workers would otherwise each unpickle a private copy.
+        train_files, val_files = train_files.share(), val_files.share()
+
+    # Define transforms
+    deterministic_transforms = get_deterministic_transforms(config)
+    if cache_dir is not None:
+        # Only runs on a cache miss; otherwise it is part of the chains below.
+        deterministic_transforms = profiler.wrap(deterministic_transforms)
+
+    if cache_dir is not None:
+        train_cls = PersistentVolumeDataset
+        train_extra = {}
+        if cache_rate is not None:
+            train_cls = RotatingCacheDataset
+            train_extra = {'cache_rate': cache_rate, 'replace_rate': replace_rate}
+        train_ds = train_cls(
+            data=train_files,
+            deterministic_transform=deterministic_transforms,
+            transform=profiler.wrap(Compose([get_random_transforms(), EnsureTyped(keys=['image', 'label'])])),
+            cache_dir=cache_dir,
+            config=config,
+            storage_dtype=storage_dtype,
+            value_range=(config['b_min'], config['b_max']),
+            profiler=profiler,
+            **train_extra,
+        )
+        val_ds = PersistentVolumeDataset(
+            data=val_files,
+            deterministic_transform=deterministic_transforms,
+            transform=profiler.wrap(EnsureTyped(keys=['image', 'label'])),
+            cache_dir=cache_dir,
+            config=config,
+            storage_dtype=storage_dtype,
+            value_range=(config['b_min'], config['b_max']),
+            profiler=profiler,
+        )
+    else:
+        train_transforms = Compose([
+            deterministic_transforms,
+            get_random_transforms(),
+            EnsureTyped(keys=['image', 'label']),
+        ])
+        val_transforms = Compose([
+            deterministic_transforms,
+            EnsureTyped(keys=['image', 'label']),
+        ])
+        train_ds = Dataset(data=train_files, transform=profiler.wrap(train_transforms))
+        val_ds = Dataset(data=val_files, transform=profiler.wrap(val_transforms))
+
+    # Create dataloaders
+    loader_kwargs = {
+        'batch_size': batch_size,
+        'num_workers': num_workers,
+        'pin_memory': torch.cuda.is_available() if pin_memory is None else pin_memory,
+        'collate_fn': profiler.wrap(collate_fn),
+    }
+    if num_workers > 0:
+        loader_kwargs['persistent_workers'] = persistent_workers
+        loader_kwargs['prefetch_factor'] = prefetch_factor
+    if distributed:
+        train_loader = DataLoader(train_ds, sampler=DistributedSampler(train_ds, shuffle=True, seed=42),
+                                  **loader_kwargs)
+        val_loader = DataLoader(val_ds, sampler=DistributedSampler(val_ds, shuffle=False), **loader_kwargs)
+    else:
+        train_loader = DataLoader(train_ds, shuffle=True, **loader_kwargs)
+        val_loader = DataLoader(val_ds, **loader_kwargs)
 
     return train_loader, val_loader
 
 if __name__ == '__main__':
     # First, we need to convert DICOM to NIfTI
     # This part needs to be run once.
-    df = pd.read_csv(CSV_PATH)
+    df = pd.read_csv(CSV_PATH, usecols=['SeriesInstanceUID'])
     patient_ids = df['SeriesInstanceUID'].unique()
 
     print("Converting DICOM to NIfTI...")
-    for patient_id in patient_ids:
-        # Assuming the DICOMs are in subdirectories named by SeriesInstanceUID
-        # under the main DICOM_DIR
-        patient_dicom_path = os.path.join(DICOM_DIR, patient_id)
-        if os.path.isdir(patient_dicom_path):
-             convert_dicom_to_nifti(patient_id, DICOM_DIR, NIFTI_DIR)
+    # Series are converted in parallel and recorded in a manifest under
+    # NIFTI_DIR, so an interrupted run picks up where it stopped. Use
+    # conversion.py directly to shard the work across HPC job-array workers.
+    summary = convert_all(patient_ids, DICOM_DIR, NIFTI_DIR)
+    print(f"Converted: {summary['done']}, failed: {summary['failed']}, skipped: {summary['skipped']}")
 
     # Now, prepare the data dictionaries
     data_dicts = get_data_dicts(CSV_PATH, NIFTI_DIR)
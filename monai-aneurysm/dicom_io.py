@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pydicom
+import torch
+from nibabel.orientations import apply_orientation, axcodes2ornt, inv_ornt_aff, io_orientation, ornt_transform
+from monai.data import MetaTensor
+from monai.transforms import EnsureChannelFirst, LoadImage, MapTransform
+
+# Only these tags are parsed when sorting slices; pixel data is never touched.
+HEADER_TAGS = [
+    'ImagePositionPatient',
+    'ImageOrientationPatient',
+    'PixelSpacing',
+    'SliceThickness',
+    'SpacingBetweenSlices',
+    'RescaleSlope',
+    'RescaleIntercept',
+    'NumberOfFrames',
+]
+
+# DICOM patient coordinates are LPS; MONAI affines are RAS.
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+# Voxel axes of the NIfTI files dicom2nifti writes with `reorient_nifti=True`:
+# x towards the patient's left, y anterior, z superior.
+NIFTI_AXCODES = ('L', 'A', 'S')
+
+
+def _read_header(path):
+    return pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+
+
+def _slice_affine(orientation, pixel_spacing, origin, slice_step):
+    """
+    Builds the LPS voxel-to-patient affine for a volume indexed as (column, row, slice).
+    """
+    row_cosine = np.asarray(orientation[:3], dtype=np.float64)
+    col_cosine = np.asarray(orientation[3:], dtype=np.float64)
+    affine = np.eye(4)
+    # PixelSpacing is (spacing between rows, spacing between columns).
+    affine[:3, 0] = row_cosine * float(pixel_spacing[1])
+    affine[:3, 1] = col_cosine * float(pixel_spacing[0])
+    affine[:3, 2] = slice_step
+    affine[:3, 3] = origin
+    return affine
+
+
+def _reorient(volume, affine, axcodes=NIFTI_AXCODES):
+    """
+    Permutes and flips the axes of an (x, y, z) volume with RAS `affine` into
+    `axcodes`, the orientation converted NIfTI files have, and updates the affine.
+    """
+    transform = ornt_transform(io_orientation(affine), axcodes2ornt(axcodes))
+    # The affine update is given by the shape before reorienting.
+    affine = affine @ inv_ornt_aff(transform, volume.shape)
+    return np.ascontiguousarray(apply_orientation(volume, transform)), affine
+
+
+def _fallback_slice_step(header, normal):
+    thickness = getattr(header, 'SpacingBetweenSlices', None) or getattr(header, 'SliceThickness', None) or 1.0
+    return normal * float(thickness)
+
+
+def _load_multiframe(path):
+    """
+    Loads an enhanced (single-file, multi-frame) series.
+    """
+    ds = pydicom.dcmread(path)
+    frames = ds.pixel_array
+    shared = ds.SharedFunctionalGroupsSequence[0] if 'SharedFunctionalGroupsSequence' in ds else ds
+    orientation = (shared.PlaneOrientationSequence[0].ImageOrientationPatient
+                   if 'PlaneOrientationSequence' in shared else ds.ImageOrientationPatient)
+    measures = shared.PixelMeasuresSequence[0] if 'PixelMeasuresSequence' in shared else ds
+    normal = np.cross(np.asarray(orientation[:3], float), np.asarray(orientation[3:], float))
+
+    if 'PerFrameFunctionalGroupsSequence' in ds:
+        positions = np.array([
+            [float(v) for v in fg.PlanePositionSequence[0].ImagePositionPatient]
+            for fg in ds.PerFrameFunctionalGroupsSequence
+        ])
+        order = np.argsort(positions @ normal, kind='stable')
+        frames, positions = frames[order], positions[order]
+        origin = positions[0]
+        step = (positions[-1] - positions[0]) / (len(positions) - 1) if len(positions) > 1 else _fallback_slice_step(measures, normal)
+    else:
+        origin = np.asarray(ds.ImagePositionPatient, dtype=np.float64)
+        step = _fallback_slice_step(measures, normal)
+
+    slope = float(getattr(ds, 'RescaleSlope', 1.0))
+    intercept = float(getattr(ds, 'RescaleIntercept', 0.0))
+    volume = frames.transpose(2, 1, 0).astype(np.float32)
+    volume *= slope
+    volume += intercept
+    return volume, _slice_affine(orientation, measures.PixelSpacing, origin, step)
+
+
+def load_dicom_series(series_dir):
+    """
+    Reads a `<SeriesInstanceUID>/*.dcm` directory into a float32 volume.
+
+    Slices are sorted along the slice normal using header-only reads, and the
+    rescale slope/intercept is applied to the whole stack at once. Returns the
+    volume and its RAS affine, matching MONAI's readers, with the voxel axes
+    in `NIFTI_AXCODES` order, so a series loads exactly like its converted
+    NIfTI file.
+    """
+    paths = sorted(
+        os.path.join(series_dir, name) for name in os.listdir(series_dir) if name.endswith('.dcm')
+    )
+    if not paths:
+        raise FileNotFoundError(f"No DICOM files found in {series_dir}")
+
+    headers = [_read_header(p) for p in paths]
+    if len(paths) == 1 and int(getattr(headers[0], 'NumberOfFrames', 1) or 1) > 1:
+        volume, affine = _load_multiframe(paths[0])
+        return _reorient(volume, LPS_TO_RAS @ affine)
+
+    orientation = headers[0].ImageOrientationPatient
+    normal = np.cross(np.asarray(orientation[:3], float), np.asarray(orientation[3:], float))
+    positions = np.array([[float(v) for v in h.ImagePositionPatient] for h in headers])
+    order = np.argsort(positions @ normal, kind='stable')
+    positions = positions[order]
+
+    # Read pixels in spatial order straight into one stack.
+    first = pydicom.dcmread(paths[order[0]]).pixel_array
+    raw = np.empty((len(paths),) + first.shape, dtype=first.dtype)
+    raw[0] = first
+    for k, i in enumerate(order[1:], start=1):
+        raw[k] = pydicom.dcmread(paths[i]).pixel_array
+
+    slopes = np.array([float(getattr(headers[i], 'RescaleSlope', 1.0) or 1.0) for i in order], dtype=np.float32)
+    intercepts = np.array([float(getattr(headers[i], 'RescaleIntercept', 0.0) or 0.0) for i in order], dtype=np.float32)
+
+    # One pass: (slice, row, column) -> (column, row, slice) float32, with the
+    # per-slice slope broadcast along the slice axis.
+    volume = np.empty(raw.shape[::-1], dtype=np.float32)
+    np.multiply(raw.transpose(2, 1, 0), slopes, out=volume, casting='unsafe')
+    volume += intercepts
+
+    if len(positions) > 1:
+        step = (positions[-1] - positions[0]) / (len(positions) - 1)
+    else:
+        step = _fallback_slice_step(headers[0], normal)
+    affine = _slice_affine(orientation, headers[0].PixelSpacing, positions[0], step)
+    return _reorient(volume, LPS_TO_RAS @ affine)
+
+
+class LoadDicomSeriesd(MapTransform):
+    """
+    Loads DICOM series directories into channel-first `MetaTensor`s.
+    """
+
+    def __call__(self, data):
+        d = dict(data)
+        for key in self.key_iterator(d):
+            series_dir = d[key]
+            volume, affine = load_dicom_series(series_dir)
+            d[key] = MetaTensor(
+                torch.from_numpy(volume)[None],
+                affine=torch.as_tensor(affine, dtype=torch.float64),
+                meta={'filename_or_obj': series_dir, 'space': 'RAS'},
+            )
+        return d
+
+
+class LoadVolumed(MapTransform):
+    """
+    Loads channel-first volumes from either NIfTI files or DICOM series
+    directories, so the same pipeline serves converted and raw data.
+    """
+
+    def __init__(self, keys, allow_missing_keys=False):
+        super().__init__(keys, allow_missing_keys)
+        self.load_image = LoadImage(image_only=True)
+        self.ensure_channel_first = EnsureChannelFirst()
+        self.load_dicom = LoadDicomSeriesd(keys, allow_missing_keys)
+
+    def __call__(self, data):
+        d = dict(data)
+        for key in self.key_iterator(d):
+            if os.path.isdir(d[key]):
+                d[key] = self.load_dicom({key: d[key]})[key]
+            else:
+                d[key] = self.ensure_channel_first(self.load_image(d[key]))
+        return d
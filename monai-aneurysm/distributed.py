@@ -0,0 +1,50 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='gloo'):
+    """
+    Joins the process group described by the torchrun environment (RANK,
+    WORLD_SIZE, MASTER_ADDR, ...). Returns `(rank, world_size)`, which is
+    `(0, 1)` when the script was not launched by torchrun.
+
+    The cores of a node are split evenly between its processes: torchrun
+    otherwise pins every process to a single thread.
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return 0, 1
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return dist.get_rank(), dist.get_world_size()
+
+
+def local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def all_reduce_sum(values):
+    """
+    Sums a list of floats across all processes (no-op in a single process).
+    """
+    tensor = torch.tensor(values, dtype=torch.float64)
+    if dist.is_initialized():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def barrier():
+    if dist.is_initialized():
+        dist.barrier()
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import torch
+from monai.data import MetaTensor
+
+from compiled import compile_model, warm_up
+from model import create_model
+
+# Backend per model file suffix.
+BACKENDS = {
+    '.onnx': 'onnx',
+    '.ts': 'torchscript',
+    '.pth': 'eager',
+}
+
+
+def load_model(checkpoint_path, device='cpu'):
+    """
+    Creates the model and loads a state-dict checkpoint in eval mode.
+    """
+    model = create_model().to(device)
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    return model.eval()
+
+
+class InferenceEngine:
+    """
+    Runs a model file with tuned CPU threading.
+
+    The backend follows the file suffix: `.onnx` runs through ONNX Runtime
+    with all graph optimizations, `.ts` through the TorchScript runtime and
+    `.pth` (a state-dict checkpoint) through eager PyTorch, on the GPU if
+    there is one. `num_threads`
+    defaults to every core; inter-op parallelism is disabled since the UNet
+    is a single chain of operators.
+
+    With `compiled`, a `.pth` model is compiled with `torch.compile` and run
+    once on each `(B, 1, D, H, W)` shape in `warmup_shapes`, so requests of
+    those shapes never wait for compilation; `warmup_seconds` records how
+    long each took.
+
+    Calling the engine on a `(B, 1, D, H, W)` array or tensor returns the
+    logits as a float32 CPU tensor.
+    """
+
+    def __init__(self, path, num_threads=None, compiled=False, warmup_shapes=()):
+        self.path = path
+        self.backend = BACKENDS.get(os.path.splitext(path)[1])
+        if self.backend is None:
+            raise ValueError(f"Unknown model file type {path!r}; expected one of {sorted(BACKENDS)}")
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.warmup_seconds = []
+
+        if self.backend == 'onnx':
+            # Imported here, so TorchScript and eager models load without it.
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.num_threads
+            options.inter_op_num_threads = 1
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+            self._input_name = self._session.get_inputs()[0].name
+        else:
+            torch.set_num_threads(self.num_threads)
+            self.device = torch.device('cpu')
+            if self.backend == 'torchscript':
+                self._model = torch.jit.load(path, map_location='cpu').eval()
+            else:
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self._model = load_model(path, self.device)
+                if compiled:
+                    self._model = compile_model(self._model)
+                    self.warmup_seconds = warm_up(self._model, warmup_shapes, self.device)
+
+    def __call__(self, inputs):
+        if isinstance(inputs, MetaTensor):
+            inputs = inputs.as_tensor()
+        if self.backend == 'onnx':
+            array = np.ascontiguousarray(torch.as_tensor(inputs, dtype=torch.float32).cpu().numpy())
+            return torch.from_numpy(self._session.run(None, {self._input_name: array})[0])
+        inputs = torch.as_tensor(inputs, dtype=torch.float32).to(self.device)
+        with torch.inference_mode():
+            return self._model(inputs).float().cpu()
+
+
+class EngineModule(torch.nn.Module):
+    """
+    Exposes an `InferenceEngine` as a module, so code written against
+    `create_model()` can run an exported model. It has no parameters to train
+    or load.
+    """
+
+    def __init__(self, path, num_threads=None):
+        super().__init__()
+        self.engine = InferenceEngine(path, num_threads=num_threads)
+
+    def forward(self, x):
+        return self.engine(x).to(x.device)
@@ -0,0 +1,129 @@
+import os
+import copy
+import json
+import time
+import argparse
+
+import torch
+from torch.func import functional_call, stack_module_state
+
+from engine import InferenceEngine, load_model
+from data_preparation import get_deterministic_transforms
+
+
+class EnsemblePredictor(torch.nn.Module):
+    """
+    Averages the probabilities of several models, e.g. the checkpoints of
+    the cross-validation folds, on one input.
+
+    Every model is loaded once and stays resident. A batch goes through them
+    back to back, each as an `InferenceEngine` (so exported `.onnx` and `.ts`
+    models mix with `.pth` checkpoints), and their probabilities are summed
+    in place. With `vmap`, all models must be `.pth` checkpoints of the same
+    architecture: their weights are stacked and the models run as one
+    vectorized call, which can pay off on GPUs.
+
+    Like `FlipTTA`, the predictor returns log probabilities, so it drops in
+    for a single model wherever logits go through a softmax. After each call
+    `latencies` holds each model's seconds (one total under `vmap`) and
+    `member_scores` each model's mean aneurysm probability per sample;
+    `total_seconds` adds the latencies up over all calls since the last
+    `reset()`, e.g. after a warm-up.
+    """
+
+    def __init__(self, paths, vmap=False, num_threads=None, compiled=False, warmup_shapes=()):
+        super().__init__()
+        if not paths:
+            raise ValueError("EnsemblePredictor needs at least one model")
+        self.paths = list(paths)
+        self.vmap = vmap
+        self.latencies = []
+        self.member_scores = []
+        self.reset()
+        if vmap:
+            if compiled:
+                raise ValueError("vmap and compiled cannot be combined")
+            if any(os.path.splitext(p)[1] != '.pth' for p in self.paths):
+                raise ValueError("vmap needs .pth checkpoints with a shared architecture")
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            models = [load_model(p, self.device) for p in self.paths]
+            self.params, self.buffers = stack_module_state(models)
+            # A weightless copy gives the architecture for functional calls.
+            self._base = copy.deepcopy(models[0]).to('meta')
+        else:
+            self.engines = [InferenceEngine(p, num_threads=num_threads, compiled=compiled,
+                                            warmup_shapes=warmup_shapes) for p in self.paths]
+
+    def reset(self):
+        """
+        Zeroes `total_seconds`.
+        """
+        self.total_seconds = [0.0] * (1 if self.vmap else len(self.paths))
+
+    def _vmapped(self, x):
+        def member(params, buffers, inputs):
+            return functional_call(self._base, (params, buffers), (inputs,))
+        with torch.inference_mode():
+            return torch.vmap(member, in_dims=(0, 0, None))(self.params, self.buffers, x.to(self.device))
+
+    def forward(self, x):
+        self.latencies, self.member_scores = [], []
+        if self.vmap:
+            start = time.perf_counter()
+            logits = self._vmapped(x)
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize(self.device)
+            self.latencies.append(time.perf_counter() - start)
+            members = list(logits)
+        else:
+            members = []
+            for engine in self.engines:
+                start = time.perf_counter()
+                # Engines return CPU tensors, so each call has finished.
+                members.append(engine(x))
+                self.latencies.append(time.perf_counter() - start)
+        self.total_seconds = [total + s for total, s in zip(self.total_seconds, self.latencies)]
+        with torch.inference_mode():
+            merged = None
+            for logits in members:
+                probs = torch.softmax(logits.float(), dim=1)
+                self.member_scores.append(probs[:, 1].flatten(1).mean(dim=1).tolist())
+                merged = probs if merged is None else merged.add_(probs)
+            return merged.div_(len(members)).log_()
+
+    def predict(self, image):
+        """
+        Scores a preprocessed channel-first `(1, D, H, W)` volume by its mean
+        aneurysm probability. Returns the combined probability with each
+        model's probability and latency.
+        """
+        start = time.perf_counter()
+        probs = torch.softmax(self(image[None]), dim=1)
+        return {
+            'probability': float(probs[:, 1].mean()),
+            'seconds': time.perf_counter() - start,
+            'vmap': self.vmap,
+            'models': [{'path': path, 'probability': scores[0],
+                        'seconds': self.latencies[i] if not self.vmap else None}
+                       for i, (path, scores) in enumerate(zip(self.paths, self.member_scores))],
+            'vmap_seconds': self.latencies[0] if self.vmap else None,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Score series with an ensemble of fold models, preprocessing each series once.")
+    parser.add_argument('models', nargs='+', help="Checkpoints (.pth) or exported models (.onnx, .ts).")
+    parser.add_argument('--series', nargs='+', required=True,
+                        help="DICOM series directories or NIfTI files to score.")
+    parser.add_argument('--vmap', action='store_true', help="Run stacked .pth weights as one vectorized call.")
+    parser.add_argument('--num-threads', type=int, default=None)
+    args = parser.parse_args()
+
+    predictor = EnsemblePredictor(args.models, vmap=args.vmap, num_threads=args.num_threads)
+    preprocess = get_deterministic_transforms()
+    for path in args.series:
+        start = time.perf_counter()
+        image = preprocess({'image': path})['image']
+        preprocess_seconds = time.perf_counter() - start
+        print(json.dumps({'series': path, 'preprocess_seconds': preprocess_seconds, **predictor.predict(image)}))
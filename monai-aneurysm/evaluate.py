@@ -1,33 +1,101 @@
 import os
+import time
+import argparse
 import torch
 import numpy as np
-from sklearn.metrics import roc_auc_score
 from tqdm import tqdm
-from monai.data import decollate_batch
-from monai.transforms import AsDiscrete, Activations
 
 from model import create_model
-from data_preparation import get_data_dicts, create_dataloaders
+from compiled import compile_model, warm_up
+from utils import as_plain_tensor
+from profiling import Profiler, format_summary
+from metric import LABEL_COLS, LABELS_CSV, bootstrap, format_table, load_labels, score, write_submission
+from data_preparation import (FULL_RESOLUTION_CONFIG, PREPROCESS_CONFIG, get_data_dicts, create_dataloaders,
+                              pad_collate)
+from sliding_window import REDUCTIONS, SlidingWindowScorer
+from cascade import CascadeScorer
+from tta import TTA_PRESETS, FlipTTA
+from ensemble import EnsemblePredictor
 
 # Define paths
 CSV_PATH = 'merged_medical_data.csv'
 NIFTI_DIR = 'nifti_files'
 CHECKPOINT_PATH = './checkpoints/best_metric_model.pth'
+# Preprocessed volumes, shared with train.py
+CACHE_DIR = './cache'
 
-def evaluate_model():
+def evaluate_model(scorer=None, compiled=False, profile_dir=None, batch_size=4, num_resamples=1000,
+                   predictions_path=None, tta='none', checkpoints=(CHECKPOINT_PATH,), vmap=False):
     """
-    Evaluates the trained model using the AUC ROC metric.
+    Evaluates the trained model with the competition metric: the weighted
+    AUC ROC over the 14 `LABEL_COLS`, printed with a per-label table.
+
+    By default scans are resized to the model input, go through the model
+    `batch_size` at a time and are scored by their mean aneurysm
+    probability. With a `SlidingWindowScorer` or a `CascadeScorer`, scans
+    are preprocessed at full resolution, padded into batches and scored one
+    by one by it instead, each cropped back to its own shape; there the
+    batch size only groups loading, and the model's batches are the
+    scorer's windows (`sw_batch_size`). Scores are written into a
+    preallocated tensor and read back once at the end. The model predicts
+    presence only, so every label gets the scan's score.
+
+    The evaluated series are the validation split of the training index and
+    every labeled series in `LABELS_CSV` the training index leaves out, so
+    both classes of 'Aneurysm Present' are covered. Labels that still have a
+    single class are left out of the weighted AUC, with a warning.
+
+    The metric comes with a 95% bootstrap confidence interval over
+    `num_resamples` resamples of the validation series (0 skips it). With
+    `predictions_path`, the scores are also saved as a `submission.parquet`,
+    so checkpoints can be compared offline with `metric.py`.
+
+    `tta` names a set of flipped views from `TTA_PRESETS`; all views of a
+    batch go through the model in one pass and their probabilities are
+    averaged. Returns the throughput, per-series latency and metric, to
+    compare configurations.
+
+    With several `checkpoints` (e.g. one per fold), their probabilities are
+    averaged by an `EnsemblePredictor`, which keeps every model resident and
+    runs them all on each preprocessed batch (vectorized with `vmap`); each
+    model's time per series is reported too.
+
+    With `compiled`, the model runs through `torch.compile` and is warmed up
+    on its input shapes first; the warm-up (first-call) time and the
+    steady-state throughput are reported separately.
+
+    With `profile_dir`, the preprocessing stages, the wait for each scan, its
+    copy to the device and its scoring are timed; per-stage latencies and a
+    Chrome trace are written there.
     """
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    profiler = Profiler(profile_dir)
 
-    # Create model and load saved weights
-    model = create_model().to(device)
-    if not os.path.exists(CHECKPOINT_PATH):
+    if not all(os.path.exists(path) for path in checkpoints):
         print("Checkpoint not found. Please train the model first.")
         return
 
-    model.load_state_dict(torch.load(CHECKPOINT_PATH, map_location=device))
-    model.eval()
+    ensemble = None
+    if len(checkpoints) > 1:
+        model = ensemble = EnsemblePredictor(checkpoints, vmap=vmap, compiled=compiled)
+    else:
+        # Create model and load saved weights
+        model = create_model().to(device)
+        model.load_state_dict(torch.load(checkpoints[0], map_location=device))
+        model.eval()
+        if compiled:
+            model = compile_model(model)
+    if tta != 'none':
+        model = FlipTTA(model, TTA_PRESETS[tta])
+    if compiled:
+        shapes = (scorer.input_shapes() if scorer is not None
+                  else [(batch_size, 1, *PREPROCESS_CONFIG['spatial_size'])])
+        seconds = warm_up(model, shapes, device)
+        print(f"Compiled model warmed up in {sum(seconds):.1f}s (first calls: "
+              f"{', '.join(f'{s:.1f}s' for s in seconds)})")
+        if ensemble is not None:
+            # The per-model times cover scoring only, not compilation.
+            ensemble.reset()
 
     # Prepare data
     data_dicts = get_data_dicts(CSV_PATH, NIFTI_DIR)
@@ -35,46 +103,156 @@ def evaluate_model():
         print("No data found. Please ensure NIfTI files are available.")
         return
 
-    _, val_loader = create_dataloaders(data_dicts, batch_size=1)
+    # The training index holds only series with an aneurysm; the labeled
+    # series it leaves out, the negatives, were never trained on.
+    labeled = get_data_dicts(LABELS_CSV, NIFTI_DIR)
+    held_out = labeled.subset(~np.isin(labeled.series_uid, data_dicts.series_uid))
 
-    y_true = []
-    y_pred = []
+    config = PREPROCESS_CONFIG if scorer is None else FULL_RESOLUTION_CONFIG
+    _, val_loader = create_dataloaders(data_dicts, batch_size=batch_size, cache_dir=CACHE_DIR, config=config,
+                                       profiler=profiler, collate_fn=pad_collate, extra_validation=held_out)
+    num_series = len(val_loader.dataset)
+    labels = load_labels(val_loader.dataset.data.series_uid)
 
-    # Post-processing for activation maps
-    # We apply softmax to get probabilities
-    post_act = Activations(softmax=True)
+    scores = torch.empty(num_series, device=device)
+    if scorer is None:
+        # Batches are copied into one input buffer. A compiled model always
+        # gets the full buffer, so a short last batch does not recompile it.
+        buffer = torch.empty((batch_size, 1, *PREPROCESS_CONFIG['spatial_size']), device=device)
 
     print("Starting evaluation...")
-    with torch.no_grad():
-        for val_data in tqdm(val_loader, desc="Evaluating"):
-            val_inputs, val_labels = val_data["image"].to(device), val_data["label"].to(device)
-            val_outputs = model(val_inputs)
-
-            # Apply activation to get probability scores for the positive class (aneurysm)
-            val_outputs = post_act(val_outputs)
-
-            # We take the probability of the aneurysm class (channel 1)
-            # and average it over all voxels to get a single score per scan.
-            # This is a simplification; a more advanced approach might use max probability.
-            pred_score = torch.mean(val_outputs[:, 1, ...]).item()
-
-            y_pred.append(pred_score)
-            y_true.append(val_labels.item())
-
-    # Calculate AUC ROC
-    # Ensure there are both classes present in the true labels for AUC calculation
-    if len(np.unique(y_true)) > 1:
-        auc_roc = roc_auc_score(y_true, y_pred)
-        print(f"Column-wise AUC ROC: {auc_roc:.4f}")
+    start = time.perf_counter()
+    offset = 0
+    # Only model calls run in inference mode (the scorers enter it themselves):
+    # compiled graphs are specialized on whether their inputs are inference
+    # tensors, and warm_up() feeds them normal ones.
+    for val_data in profiler.iterate(tqdm(val_loader, desc="Evaluating")):
+        images = as_plain_tensor(val_data["image"])
+        count = len(images)
+        if scorer is not None:
+            with profiler.span('score', device):
+                for i, (d, h, w) in enumerate(val_data["image_shape"].tolist()):
+                    scores[offset + i] = scorer(model, images[i, :, :d, :h, :w])
+            offset += count
+            continue
+        with profiler.span('host_to_device', device):
+            inputs = buffer[:count].copy_(images, non_blocking=True)
+        with profiler.span('forward', device), torch.inference_mode():
+            outputs = model(buffer if compiled else inputs)[:count]
+            # Mean probability of the aneurysm class (channel 1) over all voxels of each scan.
+            probs = torch.softmax(outputs.float(), dim=1)[:, 1].flatten(1).mean(dim=1)
+        scores[offset:offset + count] = probs
+        offset += count
+    scores = scores.cpu().numpy()
+    seconds = time.perf_counter() - start
+    print(f"Scored {num_series} series in {seconds:.1f}s ({num_series / seconds:.2f} series/s)")
+    results = {'tta': tta, 'views': len(TTA_PRESETS[tta]), 'series_per_second': num_series / seconds,
+               'seconds_per_series': seconds / num_series, 'weighted_auc': None, 'ci': None}
+    if ensemble is not None:
+        results['model_seconds_per_series'] = [s / num_series for s in ensemble.total_seconds]
+        names = ['all (vmap)'] if vmap else checkpoints
+        for name, s in zip(names, results['model_seconds_per_series']):
+            print(f"  {name}: {s:.2f}s per series")
+
+    y_score = np.repeat(scores[:, None], len(LABEL_COLS), axis=1)
+    if predictions_path is not None:
+        write_submission(predictions_path, labels.index, y_score)
+        print(f"Predictions written to {predictions_path}")
+
+    labeled = labels.notna().all(axis=1).to_numpy()
+    if labeled.any():
+        y_true, y_score = labels[labeled].to_numpy().astype(bool), y_score[labeled]
+        weighted, aucs = score(y_true, y_score)
+        report = bootstrap(y_true, y_score, num_resamples) if num_resamples else None
+        print(format_table(aucs, y_true, report))
+        print(f"Weighted AUC ROC over {labeled.sum()} labeled series: {weighted:.4f}"
+              + (f" (95% CI {report['ci'][0]:.4f}-{report['ci'][1]:.4f})" if report else ''))
+        dropped = [col for col, auc in zip(LABEL_COLS, aucs) if np.isnan(auc)]
+        if dropped:
+            print(f"Warning: {', '.join(dropped)} had a single class and no AUC; the weighted AUC leaves "
+                  f"{'them' if len(dropped) > 1 else 'it'} out and is not the competition metric.")
+        results['weighted_auc'], results['ci'] = weighted, report['ci'] if report else None
+        results['dropped_labels'] = dropped
     else:
-        print("Only one class present in the validation set, cannot calculate AUC ROC.")
-        print("True labels:", y_true)
-        print("Predicted scores:", y_pred)
+        print("No validation series has per-location labels; cannot calculate AUC ROC.")
+
+    if isinstance(scorer, CascadeScorer):
+        stats = scorer.stats()
+        print(f"Cascade refined {stats['refined']}/{stats['series']} series, "
+              f"skipping {stats['windows_skipped']:.1%} of full-resolution windows")
+
+    if profiler.enabled:
+        print(format_summary(profiler.export()))
+        print(f"Stage timings and Chrome trace written to {profile_dir}")
+    profiler.close()
+    return results
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate the aneurysm UNet on the validation split.")
+    parser.add_argument('--batch-size', type=int, default=4,
+                        help="Scans per loader batch, and per forward pass unless scoring window by window.")
+    parser.add_argument('--num-resamples', type=int, default=1000,
+                        help="Bootstrap resamples for the metric's confidence interval; 0 skips it.")
+    parser.add_argument('--predictions', default=None, metavar='PARQUET',
+                        help="Also save the validation predictions in submission format, for metric.py; "
+                             "with several --tta configurations, one file each.")
+    parser.add_argument('--sliding-window', action='store_true',
+                        help="Score full-resolution scans window by window instead of resizing them.")
+    parser.add_argument('--roi-size', type=int, nargs=3, default=list(PREPROCESS_CONFIG['spatial_size']))
+    parser.add_argument('--overlap', type=float, default=0.25)
+    parser.add_argument('--sw-batch-size', type=int, default=4 if torch.cuda.is_available() else 1,
+                        help="Windows per forward pass.")
+    parser.add_argument('--reduction', choices=REDUCTIONS, default='max')
+    parser.add_argument('--top-k', type=int, default=1000, help="Voxels averaged by the 'topk' reduction.")
+    parser.add_argument('--cascade', action='store_true',
+                        help="Screen at low resolution and refine only uncertain series, window by window.")
+    parser.add_argument('--negative-threshold', type=float, default=0.2,
+                        help="Screen scores below this are final.")
+    parser.add_argument('--positive-threshold', type=float, default=0.9,
+                        help="Screen scores from this up are final.")
+    parser.add_argument('--candidate-threshold', type=float, default=0.5,
+                        help="Screen probability that marks a region for refinement.")
+    parser.add_argument('--compile', action='store_true',
+                        help="Run the model through torch.compile, warmed up before scoring.")
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help="Time each pipeline stage and write per-stage latencies and a Chrome trace to DIR.")
+    parser.add_argument('--checkpoints', nargs='+', default=[CHECKPOINT_PATH],
+                        help="Several checkpoints (e.g. one per fold) are evaluated as an ensemble.")
+    parser.add_argument('--vmap', action='store_true',
+                        help="Run the ensemble's stacked weights as one vectorized call.")
+    parser.add_argument('--tta', nargs='+', choices=sorted(TTA_PRESETS), default=['none'],
+                        help="Flip test-time augmentation; with several, each is evaluated and compared.")
+    args = parser.parse_args()
+
     # Ensure NIfTI files exist before running evaluation
     if not os.listdir(NIFTI_DIR):
         print("NIfTI directory is empty. Please run data preparation and training first.")
     else:
-        evaluate_model()
\ No newline at end of file
+        summary = []
+        for tta in args.tta:
+            scorer = None
+            if args.sliding_window or args.cascade:
+                scorer = SlidingWindowScorer(args.roi_size, overlap=args.overlap, sw_batch_size=args.sw_batch_size,
+                                             reduction=args.reduction, top_k=args.top_k)
+            if args.cascade:
+                scorer = CascadeScorer(scorer, negative_threshold=args.negative_threshold,
+                                       positive_threshold=args.positive_threshold,
+                                       candidate_threshold=args.candidate_threshold)
+            predictions = args.predictions
+            if len(args.tta) > 1:
+                print(f"TTA: {tta}")
+                if predictions is not None:
+                    # One file per configuration, e.g. val.lr.parquet
+                    root, ext = os.path.splitext(predictions)
+                    predictions = f"{root}.{tta}{ext}"
+            summary.append(evaluate_model(scorer, compiled=args.compile, profile_dir=args.profile,
+                                          batch_size=args.batch_size, num_resamples=args.num_resamples,
+                                          predictions_path=predictions, tta=tta, checkpoints=args.checkpoints,
+                                          vmap=args.vmap))
+        if len(summary) > 1 and all(summary):
+            print(f"{'TTA':<8}{'views':>6}{'s/series':>10}{'series/s':>10}{'AUC':>8}")
+            for r in summary:
+                auc = f"{r['weighted_auc']:.4f}" if r['weighted_auc'] is not None else 'n/a'
+                print(f"{r['tta']:<8}{r['views']:>6}{r['seconds_per_series']:>10.2f}"
+                      f"{r['series_per_second']:>10.2f}{auc:>8}")
\ No newline at end of file
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import torch
+
+from engine import InferenceEngine, load_model
+
+# Define paths
+CHECKPOINT_PATH = './checkpoints/best_metric_model.pth'
+EXPORT_DIR = './exported'
+
+EXPORT_FORMATS = ('torchscript', 'onnx')
+# The UNet downsamples four times, so each spatial size must be a multiple of 16.
+DEFAULT_SHAPE = (128, 128, 128)
+
+
+def export_torchscript(model, path, example):
+    """
+    Traces the model and freezes it: weights become constants and BatchNorm
+    is folded into the convolutions. (`optimize_for_inference` on top was
+    slower for this 3D network on CPU.)
+    """
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.trace(model, example))
+    frozen.save(path)
+    return path
+
+
+def export_onnx(model, path, example, opset=17):
+    """
+    Exports the model to ONNX with dynamic batch and spatial dimensions.
+    """
+    dims = {0: 'batch', 2: 'depth', 3: 'height', 4: 'width'}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (example,), path,
+            input_names=['image'],
+            output_names=['logits'],
+            dynamic_axes={'image': dims, 'logits': dims},
+            opset_version=opset,
+            dynamo=False,
+        )
+    return path
+
+
+_EXPORTERS = {
+    'torchscript': (export_torchscript, '.ts'),
+    'onnx': (export_onnx, '.onnx'),
+}
+
+
+def _latency(fn, inputs, repeats):
+    fn(inputs)  # warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(inputs)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def export_model(checkpoint_path=CHECKPOINT_PATH, output_dir=EXPORT_DIR, formats=EXPORT_FORMATS,
+                 shape=DEFAULT_SHAPE, atol=1e-3, num_threads=None, repeats=3):
+    """
+    Exports a checkpoint to each format and checks every exported model
+    against eager PyTorch on a random input. Returns a report with the
+    maximum absolute logit difference, whether it is within `atol`, and the
+    median latency of each engine.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model = load_model(checkpoint_path)
+    example = torch.rand(1, 1, *shape)
+    name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+
+    eager = InferenceEngine(checkpoint_path, num_threads=num_threads)
+    reference = eager(example)
+    report = {'shape': list(shape), 'atol': atol,
+              'eager': {'path': checkpoint_path, 'latency_seconds': _latency(eager, example, repeats)}}
+    for fmt in formats:
+        exporter, suffix = _EXPORTERS[fmt]
+        path = exporter(model, os.path.join(output_dir, name + suffix), example)
+        engine = InferenceEngine(path, num_threads=num_threads)
+        diff = float((engine(example) - reference).abs().max())
+        report[fmt] = {
+            'path': path,
+            'max_abs_diff': diff,
+            'ok': diff <= atol,
+            'latency_seconds': _latency(engine, example, repeats),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a checkpoint to TorchScript/ONNX and validate it against eager mode.")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--output-dir', default=EXPORT_DIR)
+    parser.add_argument('--formats', nargs='+', choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    parser.add_argument('--shape', type=int, nargs=3, default=list(DEFAULT_SHAPE),
+                        help="Spatial size of the validation input.")
+    parser.add_argument('--atol', type=float, default=1e-3,
+                        help="Largest accepted logit difference from eager mode.")
+    parser.add_argument('--num-threads', type=int, default=None)
+    args = parser.parse_args()
+
+    report = export_model(args.checkpoint, args.output_dir, args.formats, tuple(args.shape), args.atol,
+                          args.num_threads)
+    print(json.dumps(report, indent=2))
+    if not all(report[fmt]['ok'] for fmt in args.formats):
+        print("Exported model differs from eager mode beyond the tolerance.")
+        sys.exit(1)
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import polars as pl
+import torch
+
+# The kaggle_evaluation package lives at the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kaggle_evaluation.rsna_gateway import LABEL_COLS
+from kaggle_evaluation.rsna_inference_server import RSNAInferenceServer
+
+from engine import InferenceEngine
+from ensemble import EnsemblePredictor
+from cascade import CascadeScorer
+from tta import TTA_PRESETS, FlipTTA, view_shapes
+from data_preparation import FULL_RESOLUTION_CONFIG, PREPROCESS_CONFIG, get_deterministic_transforms
+
+# Define paths
+CHECKPOINT_PATH = './checkpoints/best_metric_model.pth'
+# Model served: the checkpoint itself, or a model exported from it with
+# export.py (.onnx for ONNX Runtime, .ts for TorchScript). Several paths
+# separated by os.pathsep (e.g. one per fold) are served as an ensemble, all
+# resident and run on each preprocessed series.
+MODEL_PATH = os.getenv('ANEURYSM_MODEL_PATH', CHECKPOINT_PATH)
+# Set ANEURYSM_CASCADE=1 to screen each series at low resolution and refine
+# only uncertain ones at full resolution, with the model at
+# ANEURYSM_REFINE_MODEL_PATH (the screening model by default).
+CASCADE = os.getenv('ANEURYSM_CASCADE', '0') == '1'
+REFINE_MODEL_PATH = os.getenv('ANEURYSM_REFINE_MODEL_PATH', MODEL_PATH)
+# Set ANEURYSM_COMPILE=1 to run a .pth model through torch.compile, warmed up
+# at startup; compiled kernels are cached in ./compile_cache across restarts.
+COMPILE = os.getenv('ANEURYSM_COMPILE', '0') == '1'
+# Flip test-time augmentation preset (see tta.TTA_PRESETS), e.g.
+# ANEURYSM_TTA=lr; every view of a series goes through the model in one pass.
+TTA = os.getenv('ANEURYSM_TTA', 'none')
+
+_engine = None
+_refine_engine = None
+_preprocess = None
+_cascade = None
+
+
+def _load():
+    """
+    Loads the model and preprocessing once per process, on the first request.
+    """
+    global _engine, _refine_engine, _preprocess, _cascade
+    if _engine is None:
+        flips = TTA_PRESETS[TTA]
+
+        def engine(path, shapes):
+            # Warmed up for the batches the TTA wrapper builds.
+            shapes = view_shapes(shapes, flips)
+            paths = path.split(os.pathsep)
+            if len(paths) > 1:
+                loaded = EnsemblePredictor(paths, compiled=COMPILE, warmup_shapes=shapes)
+            else:
+                loaded = InferenceEngine(path, compiled=COMPILE, warmup_shapes=shapes)
+            return FlipTTA(loaded, flips) if TTA != 'none' else loaded
+
+        if CASCADE:
+            _cascade = CascadeScorer()
+            screen_shape, *refine_shapes = _cascade.input_shapes()
+            if REFINE_MODEL_PATH == MODEL_PATH:
+                _engine = _refine_engine = engine(MODEL_PATH, [screen_shape, *refine_shapes])
+            else:
+                _engine = engine(MODEL_PATH, [screen_shape])
+                _refine_engine = engine(REFINE_MODEL_PATH, refine_shapes)
+            _preprocess = get_deterministic_transforms(FULL_RESOLUTION_CONFIG)
+        else:
+            _engine = engine(MODEL_PATH, [(1, 1, *PREPROCESS_CONFIG['spatial_size'])])
+            _preprocess = get_deterministic_transforms()
+    return _engine, _preprocess
+
+
+def predict(series_path):
+    """
+    Predicts aneurysm probabilities for one series.
+
+    The gateway hands over the `<SeriesInstanceUID>/` DICOM directory, which is
+    read directly into a tensor without writing an intermediate NIfTI file.
+    """
+    engine, preprocess = _load()
+
+    image = preprocess({'image': series_path})['image']
+    if _cascade is not None:
+        score = _cascade(engine, image, refiner=_refine_engine)
+    else:
+        outputs = torch.softmax(engine(image.unsqueeze(0)).float(), dim=1)
+        score = torch.mean(outputs[:, 1, ...]).item()
+
+    # The model only predicts presence, so every location column gets the
+    # same score until a location head exists.
+    return pl.DataFrame({col: [score] for col in LABEL_COLS})
+
+
+if __name__ == '__main__':
+    # Load (and compile) before the first series arrives.
+    _load()
+    inference_server = RSNAInferenceServer(predict)
+    if os.getenv('KAGGLE_IS_COMPETITION_RERUN'):
+        inference_server.serve()
+    else:
+        inference_server.run_local_gateway()
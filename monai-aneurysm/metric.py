@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import argparse
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+# The kaggle_evaluation package lives at the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kaggle_evaluation.rsna_gateway import LABEL_COLS, SUBMISSION_ID_COL
+
+# Per-location labels of every series
+LABELS_CSV = 'train.csv'
+
+# The competition weighs 'Aneurysm Present' as much as the 13 locations together.
+LABEL_WEIGHTS = np.array([13.0 if col == 'Aneurysm Present' else 1.0 for col in LABEL_COLS])
+
+# Resampled series (resamples x series) below which bootstrapping runs in this
+# process by default: about 2.5 s of work, less than spawning workers costs.
+PARALLEL_MIN_SIZE = 5_000_000
+
+
+def load_labels(series_uids, labels_csv=LABELS_CSV):
+    """
+    Returns the `LABEL_COLS` labels of `series_uids`, in that order, as an
+    `(N, 14)` frame; series missing from `labels_csv` are all NaN.
+    """
+    labels = pd.read_csv(labels_csv, usecols=['SeriesInstanceUID', *LABEL_COLS])
+    labels = labels.drop_duplicates('SeriesInstanceUID').set_index('SeriesInstanceUID')
+    return labels.reindex(list(series_uids))[LABEL_COLS]
+
+
+def label_aucs(y_true, y_score):
+    """
+    ROC AUC of every column of `(..., N, L)` binary labels and scores at once,
+    from the Mann-Whitney statistic of tie-averaged ranks along the series
+    axis. Leading axes are batches, e.g. bootstrap resamples. A column with a
+    single class has no AUC and gives NaN.
+    """
+    y_true = np.asarray(y_true, dtype=bool)
+    ranks = rankdata(y_score, axis=-2)
+    positives = y_true.sum(axis=-2)
+    negatives = y_true.shape[-2] - positives
+    rank_sum = np.where(y_true, ranks, 0).sum(axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc = (rank_sum - positives * (positives + 1) / 2) / (positives * negatives)
+    return np.where((positives > 0) & (negatives > 0), auc, np.nan)
+
+
+def weighted_auc(aucs, weights=LABEL_WEIGHTS):
+    """
+    The competition score: the weighted mean of per-label AUCs (last axis).
+    Labels without an AUC are left out and the remaining weights renormalized.
+    """
+    aucs = np.asarray(aucs, dtype=np.float64)
+    defined = ~np.isnan(aucs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (np.where(defined, aucs, 0) * weights).sum(axis=-1) / (defined * weights).sum(axis=-1)
+
+
+def score(y_true, y_score):
+    """
+    Scores `(N, 14)` labels and predictions in `LABEL_COLS` order. Returns
+    the weighted AUC and the per-label AUCs.
+    """
+    aucs = label_aucs(y_true, y_score)
+    return float(weighted_auc(aucs)), aucs
+
+
+def _resample_scores(y_true, y_score, indices):
+    """
+    Label AUCs of the resamples in the rows of `indices`, without ranking
+    each resample: a resample only reweighs the series by how often it drew
+    them, so each label's series are sorted once and the Mann-Whitney
+    statistic is summed over groups of tied scores, weighted by those counts.
+    """
+    num_resamples, n = indices.shape
+    # counts[r, i]: how many times resample r drew series i.
+    counts = np.bincount((indices + n * np.arange(num_resamples)[:, None]).ravel(),
+                         minlength=num_resamples * n).reshape(num_resamples, n).astype(np.float64)
+    aucs = np.empty((num_resamples, y_true.shape[1]))
+    for label in range(y_true.shape[1]):
+        order = np.argsort(y_score[:, label], kind='stable')
+        sorted_scores = y_score[order, label]
+        starts = np.flatnonzero(np.r_[True, sorted_scores[1:] != sorted_scores[:-1]])
+        positive = y_true[order, label]
+        weights = counts[:, order]
+        pos = np.add.reduceat(np.where(positive, weights, 0), starts, axis=1)
+        neg = np.add.reduceat(np.where(positive, 0, weights), starts, axis=1)
+        # Negatives scored below each tie group, plus half of those tied with it.
+        below = np.cumsum(neg, axis=1) - neg
+        pairs = pos.sum(axis=1) * neg.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aucs[:, label] = np.where(pairs > 0, (pos * (below + neg / 2)).sum(axis=1) / pairs, np.nan)
+    return weighted_auc(aucs), aucs
+
+
+def bootstrap_scores(y_true, y_score, num_resamples=2000, seed=0, num_workers=None, chunk_size=250):
+    """
+    Scores `num_resamples` bootstrap resamples of the series. The resamples
+    are an `(num_resamples, N)` index matrix drawn from `seed`, scored
+    `chunk_size` rows at a time in a pool of `num_workers` processes (by
+    default all CPUs, or this process alone on a single CPU or below
+    `PARALLEL_MIN_SIZE`; with one worker or one chunk, this process scores
+    them). Returns the weighted AUC of each resample and its
+    `(num_resamples, 14)` label AUCs.
+
+    The same `seed` and number of series give the same resamples, so scores
+    of different predictions for the same series are paired.
+    """
+    y_true, y_score = np.asarray(y_true, dtype=bool), np.asarray(y_score, dtype=np.float64)
+    indices = np.random.default_rng(seed).integers(0, len(y_true), size=(num_resamples, len(y_true)))
+    chunks = np.array_split(indices, max(1, -(-num_resamples // chunk_size)))
+    if num_workers is None:
+        num_workers = (os.cpu_count() or 1) if num_resamples * len(y_true) >= PARALLEL_MIN_SIZE else 1
+    if num_workers <= 1 or len(chunks) == 1:
+        results = [_resample_scores(y_true, y_score, chunk) for chunk in chunks]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(chunks)), mp_context=context) as pool:
+            results = list(pool.map(_resample_scores, [y_true] * len(chunks), [y_score] * len(chunks), chunks))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def confidence_interval(values, confidence=0.95):
+    """
+    Percentile interval of bootstrap `values` along the first axis, ignoring
+    resamples where a value is undefined.
+    """
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # A label with a single class in every resample has no interval.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lo, hi = np.nanpercentile(values, [tail, 100 - tail], axis=0)
+    return lo, hi
+
+
+def bootstrap(y_true, y_score, num_resamples=2000, confidence=0.95, seed=0, num_workers=None):
+    """
+    The weighted AUC and per-label AUCs of `(N, 14)` labels and predictions,
+    with bootstrap confidence intervals over series.
+    """
+    return _report(y_true, y_score, *bootstrap_scores(y_true, y_score, num_resamples, seed, num_workers),
+                   confidence)
+
+
+def _report(y_true, y_score, resampled, resampled_aucs, confidence):
+    weighted, aucs = score(y_true, y_score)
+    lo, hi = confidence_interval(resampled, confidence)
+    label_lo, label_hi = confidence_interval(resampled_aucs, confidence)
+    return {
+        'weighted_auc': weighted,
+        'ci': [float(lo), float(hi)],
+        'std': float(np.nanstd(resampled)),
+        'confidence': confidence,
+        'num_resamples': len(resampled),
+        'num_series': len(y_true),
+        'labels': {col: {'auc': _or_none(auc), 'ci': [_or_none(l), _or_none(h)]}
+                   for col, auc, l, h in zip(LABEL_COLS, aucs, label_lo, label_hi)},
+    }
+
+
+def _or_none(value):
+    # JSON has no NaN.
+    return None if np.isnan(value) else float(value)
+
+
+def format_table(aucs, y_true, report=None):
+    """
+    Per-label AUCs as a table, with each label's positives and weight, and
+    their confidence intervals from a `bootstrap()` report.
+    """
+    positives = np.asarray(y_true, dtype=bool).sum(axis=0)
+    lines = [f"{'label':<44}{'positives':>10}{'weight':>8}{'AUC':>8}" + (f"{'CI':>18}" if report else '')]
+    for col, auc, n, weight in zip(LABEL_COLS, aucs, positives, LABEL_WEIGHTS):
+        line = f"{col:<44}{n:>10}{weight:>8.0f}{f'{auc:.4f}' if not np.isnan(auc) else 'n/a':>8}"
+        if report:
+            lo, hi = report['labels'][col]['ci']
+            line += f"{f'[{lo:.3f}, {hi:.3f}]' if lo is not None else 'n/a':>18}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def write_submission(path, series_uids, y_score):
+    """
+    Writes `(N, 14)` predictions as a `submission.parquet`, for `compare_submissions`.
+    """
+    submission = pd.DataFrame(np.asarray(y_score), columns=LABEL_COLS)
+    submission.insert(0, SUBMISSION_ID_COL, list(series_uids))
+    submission.to_parquet(path, index=False)
+
+
+def compare_submissions(paths, labels_csv=LABELS_CSV, num_resamples=2000, confidence=0.95, seed=0,
+                        num_workers=None):
+    """
+    Bootstraps the score of each `submission.parquet` in `paths` on the
+    labeled series they all predict. The resamples are shared, so the
+    difference of each submission from the first gets a paired interval too.
+    """
+    submissions = [pd.read_parquet(path).drop_duplicates(SUBMISSION_ID_COL).set_index(SUBMISSION_ID_COL)
+                   for path in paths]
+    series = submissions[0].index
+    for submission in submissions[1:]:
+        series = series.intersection(submission.index)
+    labels = load_labels(series, labels_csv)
+    series = labels.index[labels.notna().all(axis=1).to_numpy()]
+    y_true = labels.loc[series].to_numpy().astype(bool)
+
+    report = {'num_series': len(series), 'submissions': {}}
+    baseline = None
+    for path, submission in zip(paths, submissions):
+        y_score = submission.loc[series, LABEL_COLS].to_numpy(dtype=np.float64)
+        # Same seed and series: the same resamples as the first submission.
+        resampled, resampled_aucs = bootstrap_scores(y_true, y_score, num_resamples, seed, num_workers)
+        result = _report(y_true, y_score, resampled, resampled_aucs, confidence)
+        if baseline is None:
+            baseline = resampled
+        else:
+            difference = resampled - baseline
+            lo, hi = confidence_interval(difference, confidence)
+            # Resamples where either score is undefined do not count.
+            defined = difference[~np.isnan(difference)]
+            result['difference_from_first'] = {
+                'mean': _or_none(defined.mean()) if len(defined) else None,
+                'ci': [_or_none(lo), _or_none(hi)],
+                'probability_better': float((defined > 0).mean()) if len(defined) else None,
+            }
+        report['submissions'][path] = result
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Score submission.parquet files with the competition metric and bootstrap confidence intervals.")
+    parser.add_argument('submissions', nargs='+',
+                        help="Parquet files with a SeriesInstanceUID column and one column per label; "
+                             "later ones are also compared with the first.")
+    parser.add_argument('--labels', default=LABELS_CSV)
+    parser.add_argument('--num-resamples', type=int, default=2000)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--num-workers', type=int, default=None,
+                        help="Processes for the resamples (all CPUs, unless the workload is small).")
+    parser.add_argument('--output', default=None, help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    report = compare_submissions(args.submissions, args.labels, args.num_resamples, args.confidence, args.seed,
+                                 args.num_workers)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
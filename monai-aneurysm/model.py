@@ -2,10 +2,21 @@ import torch
 from monai.networks.nets import UNet
 from monai.networks.layers import Norm
 
-def create_model():
+# Static int8 model written by quantize.py
+QUANTIZED_MODEL_PATH = './exported/best_metric_model.int8.onnx'
+
+def create_model(quantized=False, quantized_path=QUANTIZED_MODEL_PATH):
     """
     Creates a 3D U-Net model for aneurysm detection.
+
+    With `quantized`, returns the int8 model produced by `quantize.py` instead,
+    already trained and running on CPU through ONNX Runtime; there is no
+    checkpoint to load into it.
     """
+    if quantized:
+        from engine import EngineModule
+        return EngineModule(quantized_path)
+
     # Define the model parameters
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
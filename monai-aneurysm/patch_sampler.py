@@ -0,0 +1,193 @@
+import os
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import torch
+from monai.data import DataLoader
+from monai.transforms import Compose, EnsureTyped, Randomizable, ScaleIntensityRanged
+
+from data_preparation import PREPROCESS_CONFIG, get_data_dicts, get_random_transforms
+from volume_store import ChunkedVolume
+
+# Define paths
+CSV_PATH = 'merged_medical_data.csv'
+STORE_DIR = 'volume_store'
+INDEX_PATH = 'localizer_index.npz'
+
+LOCALIZER_COLUMNS = [
+    'SeriesInstanceUID',
+    'x_coord',
+    'y_coord',
+    'ImagePositionPatient',
+    'ImageOrientationPatient',
+    'PixelSpacing',
+]
+
+
+def _parse_vectors(column):
+    """
+    Parses a column of "['1.0', '0.0', ...]" strings into a float matrix in one pass.
+    """
+    return (column.str.strip('[]').str.replace("'", '', regex=False)
+            .str.split(',', expand=True).astype(np.float64).to_numpy())
+
+
+def localizer_world_coords(csv_path):
+    """
+    Converts every localizer's in-plane pixel coordinate into a RAS world
+    position using the header of the slice it was placed on.
+    """
+    df = pd.read_csv(csv_path, usecols=LOCALIZER_COLUMNS).dropna()
+    position = _parse_vectors(df['ImagePositionPatient'])
+    orientation = _parse_vectors(df['ImageOrientationPatient'])
+    spacing = _parse_vectors(df['PixelSpacing'])
+
+    # x runs along the row direction (column index), y along the column direction.
+    x = df['x_coord'].to_numpy()[:, None]
+    y = df['y_coord'].to_numpy()[:, None]
+    lps = position + x * spacing[:, 1:2] * orientation[:, :3] + y * spacing[:, 0:1] * orientation[:, 3:]
+    ras = lps * np.array([-1.0, -1.0, 1.0])
+    return df['SeriesInstanceUID'].to_numpy(), ras
+
+
+def build_localizer_index(csv_path, store_dir, index_path=INDEX_PATH):
+    """
+    Precomputes, once, the voxel coordinates of every localizer in each stored
+    volume. Points are kept in CSR layout (`offsets[i]:offsets[i + 1]` are the
+    points of series `i`), so the sampler finds a series' points in O(1).
+    """
+    data = get_data_dicts(csv_path, store_dir, suffix='.vol')
+    point_series, world = localizer_world_coords(csv_path)
+
+    order = np.argsort(point_series, kind='stable')
+    point_series, world = point_series[order], world[order]
+    starts = np.searchsorted(point_series, data.series_uid, side='left')
+    stops = np.searchsorted(point_series, data.series_uid, side='right')
+
+    shapes = np.zeros((len(data), 3), dtype=np.int64)
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    points = []
+    for i, path in enumerate(data.image):
+        # Only the header is read; no chunk is decompressed.
+        store = ChunkedVolume(path)
+        shapes[i] = store.shape
+        ras = world[starts[i]:stops[i]]
+        voxel = (np.linalg.inv(store.affine) @ np.c_[ras, np.ones(len(ras))].T).T[:, :3]
+        points.append(voxel.astype(np.float32))
+        offsets[i + 1] = offsets[i] + len(ras)
+
+    np.savez(
+        index_path,
+        series_uid=data.series_uid,
+        image=data.image,
+        label=data.label,
+        shape=shapes,
+        offsets=offsets,
+        points=np.concatenate(points) if points else np.zeros((0, 3), np.float32),
+    )
+    return index_path
+
+
+class LocalizerPatchDataset(Randomizable, torch.utils.data.Dataset):
+    """
+    Draws fixed-size patches from chunked volumes, centred on a localizer
+    point with probability `pos_fraction` and placed uniformly otherwise.
+
+    The label is 1 when a localizer point falls inside the patch. Each sample
+    reads only the chunks under the patch, at the stored resolution. At most
+    `max_open_stores` volumes stay open per worker; the least recently used
+    one is closed to make room for another.
+    """
+
+    def __init__(self, index_path, patch_size=(64, 64, 64), pos_fraction=0.5, jitter=16,
+                 samples_per_epoch=None, transform=None, max_open_stores=64):
+        index = np.load(index_path)
+        self.image = index['image']
+        self.shape = index['shape']
+        self.offsets = index['offsets']
+        self.points = index['points']
+        self.patch_size = np.asarray(patch_size, dtype=np.int64)
+        self.pos_fraction = pos_fraction
+        self.jitter = jitter
+        self.samples_per_epoch = samples_per_epoch or len(self.image)
+        self.transform = transform
+        self.max_open_stores = max_open_stores
+        self._stores = OrderedDict()
+
+    def __len__(self):
+        return self.samples_per_epoch
+
+    def _store(self, series):
+        if series in self._stores:
+            self._stores.move_to_end(series)
+            return self._stores[series]
+        # Every open store holds a file descriptor; keep them under `ulimit -n`.
+        while len(self._stores) >= self.max_open_stores:
+            self._stores.popitem(last=False)[1].close()
+        self._stores[series] = store = ChunkedVolume(str(self.image[series]))
+        return store
+
+    def randomize(self, series):
+        points = self.points[self.offsets[series]:self.offsets[series + 1]]
+        if len(points) and self.R.rand() < self.pos_fraction:
+            center = points[self.R.randint(len(points))] + self.R.uniform(-self.jitter, self.jitter, 3)
+        else:
+            center = self.R.uniform(0, self.shape[series])
+        start = np.round(center).astype(np.int64) - self.patch_size // 2
+        inside = np.all((points >= start) & (points < start + self.patch_size), axis=1)
+        return start, int(inside.any())
+
+    def __getitem__(self, index):
+        series = index % len(self.image)
+        start, label = self.randomize(series)
+        patch = self._store(series).read_roi(start, self.patch_size)
+        item = {
+            'image': torch.from_numpy(patch)[None],
+            'label': np.int64(label),
+        }
+        return self.transform(item) if self.transform is not None else item
+
+
+def get_patch_transforms(config=PREPROCESS_CONFIG):
+    """
+    Returns the per-patch intensity window followed by the random augmentations.
+    """
+    return Compose([
+        ScaleIntensityRanged(keys=['image'], a_min=config['a_min'], a_max=config['a_max'],
+                             b_min=config['b_min'], b_max=config['b_max'], clip=True),
+        get_random_transforms(),
+        EnsureTyped(keys=['image', 'label']),
+    ])
+
+
+def create_patch_dataloader(index_path=INDEX_PATH, batch_size=8, patch_size=(64, 64, 64),
+                            pos_fraction=0.5, samples_per_epoch=None, num_workers=4):
+    """
+    Creates a training dataloader of localizer-guided patches.
+    """
+    ds = LocalizerPatchDataset(
+        index_path,
+        patch_size=patch_size,
+        pos_fraction=pos_fraction,
+        samples_per_epoch=samples_per_epoch,
+        transform=get_patch_transforms(),
+    )
+    return DataLoader(ds, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the localizer voxel index for patch sampling.")
+    parser.add_argument('--csv-path', default=CSV_PATH)
+    parser.add_argument('--store-dir', default=STORE_DIR,
+                        help="Directory written by `conversion.py --format chunked`.")
+    parser.add_argument('--index-path', default=INDEX_PATH)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.store_dir):
+        print(f"{args.store_dir} not found. Run `python monai-aneurysm/conversion.py --format chunked` first.")
+    else:
+        path = build_localizer_index(args.csv_path, args.store_dir, args.index_path)
+        index = np.load(path)
+        print(f"Indexed {len(index['points'])} localizer points across {len(index['image'])} series in {path}.")
@@ -0,0 +1,51 @@
+import contextlib
+
+import torch
+
+# Training/inference precision modes. Weights and optimizer state stay fp32;
+# the lower precisions only apply to autocast regions.
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+
+_AUTOCAST_DTYPES = {
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+
+
+def check_precision(device, precision):
+    """
+    Raises if `precision` cannot run on `device`.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision {precision!r}; expected one of {PRECISIONS}")
+    if precision == 'bf16' and device.type == 'cuda' and not torch.cuda.is_bf16_supported():
+        raise ValueError("bf16 is not supported on this GPU")
+    if precision == 'fp16' and device.type != 'cuda':
+        # CPU fp16 autocast exists but runs far slower than fp32 without
+        # native fp16 kernels; use bf16 there.
+        raise ValueError("fp16 needs a CUDA device; use bf16 on CPU")
+
+
+def autocast(device, precision):
+    """
+    Returns the autocast context for a forward pass (a no-op for fp32).
+    """
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=_AUTOCAST_DTYPES[precision])
+
+
+def grad_scaler(device, precision):
+    """
+    Returns a loss scaler, enabled only for fp16 whose narrow exponent range
+    underflows small gradients. bf16 has the fp32 range and needs none.
+    """
+    return torch.amp.GradScaler(device.type, enabled=precision == 'fp16')
+
+
+def to_channels_last(x, channels_last=True):
+    """
+    Converts a model or a 5D tensor to the channels-last-3d (NDHWC) layout,
+    which the oneDNN CPU convolution kernels run without reordering.
+    """
+    return x.to(memory_format=torch.channels_last_3d) if channels_last else x
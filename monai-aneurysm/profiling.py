@@ -0,0 +1,247 @@
+import os
+import glob
+import json
+import time
+import threading
+
+import numpy as np
+from monai.transforms import Compose, apply_transform
+
+# Upper edges of the latency histogram buckets: 10 µs to 100 s, four per decade.
+HISTOGRAM_EDGES = np.logspace(-5, 2, 29)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'device', 'start')
+
+    def __init__(self, profiler, name, device):
+        self.profiler = profiler
+        self.name = name
+        self.device = device
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device is not None and self.device.type == 'cuda':
+            # Kernels run asynchronously; wait for them so the span covers them.
+            import torch
+            torch.cuda.synchronize(self.device)
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class _Timed:
+    """
+    Calls `fn` inside a span, e.g. the collate function of a loader.
+    """
+
+    def __init__(self, profiler, name, fn):
+        self.profiler = profiler
+        self.name = name
+        self.fn = fn
+
+    def __call__(self, *args, **kwargs):
+        with self.profiler.span(self.name):
+            return self.fn(*args, **kwargs)
+
+
+class ProfiledCompose(Compose):
+    """
+    A copy of `compose` that times each of its transforms, named after the
+    transform class. Nested Composes are profiled in turn. The transforms
+    themselves are shared, so cache keys and random states are unchanged.
+    """
+
+    def __init__(self, compose, profiler):
+        self.__dict__.update(vars(compose))
+        self.transforms = [ProfiledCompose(t, profiler) if isinstance(t, Compose) else t
+                           for t in compose.transforms]
+        self.profiler = profiler
+
+    def __call__(self, input_, start=0, end=None, threading=False, lazy=None):
+        if threading or (self._lazy if lazy is None else lazy):
+            # Cache-dataset threading splits and lazy resampling are not timed.
+            return super().__call__(input_, start=start, end=end, threading=threading, lazy=lazy)
+        for transform in self.transforms[start:end]:
+            if isinstance(transform, Compose):
+                input_ = transform(input_)
+                continue
+            with self.profiler.span(type(transform).__name__):
+                input_ = apply_transform(transform, input_, self.map_items, self.unpack_items,
+                                         overrides=self.overrides)
+        return input_
+
+
+class Profiler:
+    """
+    Low-overhead timers for the stages of the data and model pipeline.
+
+    Spans are appended, one JSON line each, to a file per process under
+    `trace_dir`, so loader workers (forked or spawned) and distributed ranks
+    report into the same run. `summary()` aggregates every file into per-stage
+    call counts, p50/p99 latencies and histograms; `export()` writes them as
+    JSON next to a Chrome trace (load it in chrome://tracing or Perfetto).
+
+    Without a `trace_dir` the profiler is disabled: `span()` returns a shared
+    no-op context, and `wrap()` and `iterate()` return their argument
+    unchanged, so instrumented code runs as it would without it. With `clear`,
+    spans left in `trace_dir` by an earlier run are removed.
+    """
+
+    def __init__(self, trace_dir=None, clear=True):
+        self.trace_dir = os.path.abspath(trace_dir) if trace_dir is not None else None
+        self.enabled = trace_dir is not None
+        self._file = None
+        self._pid = None
+        if self.enabled:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            if clear:
+                for path in self._span_files():
+                    os.remove(path)
+
+    def _span_files(self):
+        return glob.glob(os.path.join(self.trace_dir, 'spans.*.jsonl'))
+
+    def span(self, name, device=None):
+        """
+        Context manager timing its body as a `name` span. For a CUDA `device`,
+        pending kernels are waited for before the span closes.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, device)
+
+    def record(self, name, start, end):
+        """
+        Records a span from `time.perf_counter()` timestamps.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            # First span of this process, or of a worker forked with our file.
+            self._file = open(os.path.join(self.trace_dir, f"spans.{pid}.jsonl"), 'a', buffering=1)
+            self._pid = pid
+        # Line-buffered, so spans of workers that exit abruptly are kept.
+        self._file.write(json.dumps({'name': name, 'start': start, 'duration': end - start, 'pid': pid,
+                                     'tid': threading.get_ident()}) + '\n')
+
+    def wrap(self, transform):
+        """
+        Times each stage of a Compose, or a whole callable such as a collate
+        function under the name of its class or function.
+        """
+        if not self.enabled or transform is None:
+            return transform
+        if isinstance(transform, Compose):
+            return ProfiledCompose(transform, self)
+        return _Timed(self, getattr(transform, '__name__', type(transform).__name__), transform)
+
+    def iterate(self, iterable, name='data_wait'):
+        """
+        Yields from `iterable`, timing each wait for the next item as `name`.
+        """
+        if not self.enabled:
+            return iterable
+        return self._iterate(iterable, name)
+
+    def _iterate(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, start, time.perf_counter())
+            yield item
+
+    def spans(self):
+        """
+        Every span recorded under `trace_dir` so far, by any process.
+        """
+        spans = []
+        for path in self._span_files():
+            with open(path) as f:
+                # A worker may be mid-write; skip its partial last line.
+                spans.extend(json.loads(line) for line in f if line.endswith('\n'))
+        return spans
+
+    def summary(self):
+        """
+        Per-stage call counts, total and mean seconds, p50/p99/max latencies
+        and a histogram over `HISTOGRAM_EDGES` (the last bucket is open-ended).
+        """
+        durations = {}
+        for span in self.spans():
+            durations.setdefault(span['name'], []).append(span['duration'])
+        summary = {}
+        for name, values in durations.items():
+            values = np.asarray(values)
+            counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES, values), minlength=len(HISTOGRAM_EDGES) + 1)
+            summary[name] = {
+                'count': len(values),
+                'total_seconds': float(values.sum()),
+                'mean_seconds': float(values.mean()),
+                'p50_seconds': float(np.percentile(values, 50)),
+                'p99_seconds': float(np.percentile(values, 99)),
+                'max_seconds': float(values.max()),
+                'histogram': {'upper_edges_seconds': HISTOGRAM_EDGES.tolist(), 'counts': counts.tolist()},
+            }
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['total_seconds']))
+
+    def chrome_trace(self):
+        """
+        The spans as Chrome trace events, in microseconds.
+        """
+        return {'traceEvents': [
+            {'name': s['name'], 'ph': 'X', 'ts': s['start'] * 1e6, 'dur': s['duration'] * 1e6,
+             'pid': s['pid'], 'tid': s['tid']}
+            for s in self.spans()
+        ]}
+
+    def export(self):
+        """
+        Writes `summary.json` and `trace.json` under `trace_dir` and returns the summary.
+        """
+        if not self.enabled:
+            return {}
+        summary = self.summary()
+        with open(os.path.join(self.trace_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        with open(os.path.join(self.trace_dir, 'trace.json'), 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return summary
+
+    def close(self):
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file = self._pid = None
+
+    def __getstate__(self):
+        # Spawned workers open their own file.
+        state = self.__dict__.copy()
+        state['_file'] = state['_pid'] = None
+        return state
+
+
+def format_summary(summary):
+    """
+    The summary as a table, one stage per line, slowest in total first.
+    """
+    lines = [f"{'stage':<28}{'calls':>8}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}"]
+    for name, s in summary.items():
+        lines.append(f"{name:<28}{s['count']:>8}{s['total_seconds']:>10.2f}"
+                     f"{s['p50_seconds'] * 1000:>10.1f}{s['p99_seconds'] * 1000:>10.1f}")
+    return '\n'.join(lines)
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.metrics import roc_auc_score
+
+from cache import PersistentVolumeDataset
+from data_preparation import PREPROCESS_CONFIG, create_dataloaders, get_data_dicts, get_deterministic_transforms
+from engine import InferenceEngine, load_model
+from export import CHECKPOINT_PATH, export_onnx
+from model import QUANTIZED_MODEL_PATH
+from utils import peak_rss_bytes
+
+# The kaggle_evaluation package lives at the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kaggle_evaluation.rsna_gateway import LABEL_COLS
+
+# Define paths
+CSV_PATH = 'merged_medical_data.csv'
+# Per-location labels of every series
+LABELS_CSV = 'train.csv'
+NIFTI_DIR = 'nifti_files'
+CACHE_DIR = './cache'
+ONNX_PATH = './exported/best_metric_model.onnx'
+
+
+def calibration_dataset(data_dicts, cache_dir=CACHE_DIR):
+    """
+    Cached volumes without augmentation: the inputs the model sees at inference.
+    """
+    return PersistentVolumeDataset(
+        data=data_dicts,
+        deterministic_transform=get_deterministic_transforms(),
+        cache_dir=cache_dir,
+        config=PREPROCESS_CONFIG,
+        storage_dtype='int16',
+        value_range=(PREPROCESS_CONFIG['b_min'], PREPROCESS_CONFIG['b_max']),
+    )
+
+
+def quantize_model(onnx_path, output_path, dataset, num_calibration=32, seed=0):
+    """
+    Statically quantizes an ONNX model to int8: per-channel int8 weights and
+    uint8 activations whose ranges are calibrated on `num_calibration`
+    samples of `dataset`.
+    """
+    # onnxruntime (see requirements.txt) is only imported when quantizing.
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class CachedVolumeReader(CalibrationDataReader):
+        # Feeds the calibrator one preprocessed volume at a time.
+        def __init__(self, indices):
+            self.indices = iter(indices)
+
+        def get_next(self):
+            index = next(self.indices, None)
+            if index is None:
+                return None
+            return {'image': np.asarray(dataset[int(index)]['image'], dtype=np.float32)[None]}
+
+    reader = CachedVolumeReader(np.random.RandomState(seed).permutation(len(dataset))[:num_calibration])
+
+    # Shape inference and graph cleanup first, as ONNX Runtime recommends.
+    prepared_path = f"{output_path}.{os.getpid()}.pre.onnx"
+    quant_pre_process(onnx_path, prepared_path, skip_symbolic_shape=True)
+    try:
+        quantize_static(
+            prepared_path, output_path, reader,
+            quant_format=QuantFormat.QOperator,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    finally:
+        os.remove(prepared_path)
+    return output_path
+
+
+def _score_series(model_path, dataset, num_threads):
+    """
+    Scores every series of `dataset` with one engine. Meant to run in a fresh
+    process so the peak RSS belongs to that engine alone.
+    """
+    engine = InferenceEngine(model_path, num_threads=num_threads)
+    scores, latencies = [], []
+    for index in range(len(dataset)):
+        image = dataset[index]['image']
+        start = time.perf_counter()
+        outputs = torch.softmax(engine(torch.as_tensor(np.asarray(image))[None]), dim=1)
+        latencies.append(time.perf_counter() - start)
+        scores.append(float(outputs[:, 1].mean()))
+    return {
+        'scores': scores,
+        'latency_seconds_median': float(np.median(latencies)),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'model_bytes': os.path.getsize(model_path),
+    }
+
+
+def _per_label_auc(labels, scores):
+    aucs = {}
+    for col in LABEL_COLS:
+        y = labels[col].to_numpy().astype(np.int64)
+        # AUC is undefined when a label has a single class in the set.
+        aucs[col] = float(roc_auc_score(y, scores)) if len(np.unique(y)) > 1 else None
+    return aucs
+
+
+def quantization_report(fp32_path, int8_path, dataset, series_uids, labels_csv=LABELS_CSV, num_threads=None):
+    """
+    Scores `dataset` with the fp32 and int8 models and compares per-label AUC,
+    median per-series latency, peak RSS and model size.
+
+    Raises a ValueError, before scoring, if the labeled series have a single
+    class of 'Aneurysm Present', the label that dominates the metric.
+    """
+    labels = pd.read_csv(labels_csv, usecols=['SeriesInstanceUID', *LABEL_COLS]).drop_duplicates('SeriesInstanceUID')
+    labels = labels.set_index('SeriesInstanceUID').reindex(series_uids)
+    labeled = labels.notna().all(axis=1).to_numpy()
+    if labels.loc[labeled, 'Aneurysm Present'].nunique() < 2:
+        raise ValueError("'Aneurysm Present' has a single class in the evaluated series; add negatives "
+                         "(series without an aneurysm) so int8 and fp32 can be compared on it")
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name, path in (('fp32', fp32_path), ('int8', int8_path)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[name] = pool.submit(_score_series, path, dataset, num_threads).result()
+
+    # The model predicts presence only; every label gets the series score.
+    auc = {name: _per_label_auc(labels[labeled], np.asarray(r['scores'])[labeled]) for name, r in results.items()}
+
+    report = {'num_series': len(series_uids), 'num_labeled': int(labeled.sum()), 'labels': {}}
+    for col in LABEL_COLS:
+        fp32_auc, int8_auc = auc['fp32'][col], auc['int8'][col]
+        report['labels'][col] = {
+            'fp32_auc': fp32_auc,
+            'int8_auc': int8_auc,
+            'delta': int8_auc - fp32_auc if fp32_auc is not None else None,
+        }
+    for name, r in results.items():
+        report[name] = {k: v for k, v in r.items() if k != 'scores'}
+    report['max_score_diff'] = float(np.max(np.abs(np.subtract(results['int8']['scores'],
+                                                               results['fp32']['scores']))))
+    report['speedup'] = results['fp32']['latency_seconds_median'] / results['int8']['latency_seconds_median']
+    report['size_ratio'] = results['int8']['model_bytes'] / results['fp32']['model_bytes']
+    report['rss_ratio'] = results['int8']['peak_rss_bytes'] / results['fp32']['peak_rss_bytes']
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Statically quantize the UNet to int8 and compare it with fp32.")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH,
+                        help="Exported to ONNX first if --onnx does not exist.")
+    parser.add_argument('--onnx', default=ONNX_PATH)
+    parser.add_argument('--output', default=QUANTIZED_MODEL_PATH)
+    parser.add_argument('--num-calibration', type=int, default=32,
+                        help="Cached training volumes used to calibrate activation ranges.")
+    parser.add_argument('--num-threads', type=int, default=None)
+    parser.add_argument('--report', default=None, help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    data_dicts = get_data_dicts(CSV_PATH, NIFTI_DIR)
+    if not data_dicts:
+        print("No data found. Please run data_preparation.py first to convert DICOM to NIfTI.")
+        sys.exit(1)
+    # The training index holds only series with an aneurysm; the labeled
+    # series it leaves out, the negatives, are validated too (as in evaluate.py).
+    labeled = get_data_dicts(LABELS_CSV, NIFTI_DIR)
+    held_out = labeled.subset(~np.isin(labeled.series_uid, data_dicts.series_uid))
+    train_loader, val_loader = create_dataloaders(data_dicts, cache_dir=CACHE_DIR, num_workers=0,
+                                                  extra_validation=held_out)
+
+    if not os.path.exists(args.onnx):
+        os.makedirs(os.path.dirname(args.onnx) or '.', exist_ok=True)
+        shape = PREPROCESS_CONFIG['spatial_size']
+        export_onnx(load_model(args.checkpoint), args.onnx, torch.rand(1, 1, *shape))
+
+    quantize_model(args.onnx, args.output, calibration_dataset(train_loader.dataset.data), args.num_calibration)
+    val_ds = calibration_dataset(val_loader.dataset.data)
+    report = quantization_report(args.onnx, args.output, val_ds, val_ds.data.series_uid,
+                                 num_threads=args.num_threads)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(text + '\n')
@@ -0,0 +1,180 @@
+import time
+import queue
+import threading
+import multiprocessing
+
+import numpy as np
+
+from cache import PersistentVolumeDataset
+from volume_store import decode_volume
+
+
+class RotatingCacheDataset(PersistentVolumeDataset):
+    """
+    Keeps a fixed fraction of the preprocessed volumes in RAM and rotates them.
+
+    An epoch iterates over the `cache_rate * len(data)` samples currently held
+    in memory. Between epochs `update_cache()` retires the `replace_rate`
+    oldest slots and fills them with the next samples of a fixed permutation,
+    which a background thread has already read from the on-disk cache. Every
+    sample is therefore visited once every `len(data) / replace_num` epochs,
+    while memory stays bounded by `cache_num + replace_num` volumes. Volumes
+    are held in the cache's storage dtype and decoded per sample.
+
+    A slot whose volume is not loaded yet (the first epoch, or a replacement
+    that has not finished) is read from disk and counted as a miss. Hits,
+    misses and replacement latency are reported by `update_cache()`.
+
+    Loader workers see the cache as it was when they were started, so use
+    non-persistent workers (re-created each epoch) when `num_workers > 0`.
+    """
+
+    def __init__(self, data, deterministic_transform, transform=None, cache_rate=0.5, replace_rate=0.25,
+                 seed=0, **kwargs):
+        super().__init__(data, deterministic_transform, transform=transform, **kwargs)
+        n = len(data)
+        self.cache_num = min(n, max(1, int(round(n * cache_rate))))
+        self.replace_num = min(n - self.cache_num, max(1, int(round(self.cache_num * replace_rate))))
+
+        # Samples enter the cache in this order, cycling; the slots form a FIFO
+        # over it, so a sample is never brought in while it is still cached.
+        self._order = np.random.RandomState(seed).permutation(n)
+        self._slots = self._order[:self.cache_num].copy()
+        self._volumes = [None] * self.cache_num
+        self._next = self.cache_num % n if n else 0
+        self._retire = 0
+
+        # Shared with loader workers, so their hits are counted too.
+        self._hits = multiprocessing.Value('q', 0)
+        self._misses = multiprocessing.Value('q', 0)
+        self._lock = threading.Lock()
+        self._staged = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._latencies = []
+
+    def __len__(self):
+        return self.cache_num
+
+    def _fill(self):
+        while True:
+            index = self._queue.get()
+            if index is None:
+                return
+            start = time.perf_counter()
+            # Copy out of the memory map so the volume is resident.
+            volume = np.array(self._load(dict(self.data[index])))
+            with self._lock:
+                self._latencies.append(time.perf_counter() - start)
+                slot = np.flatnonzero(self._slots == index)
+                if len(slot):
+                    if self._volumes[slot[0]] is None:
+                        self._volumes[slot[0]] = volume
+                elif index in self._upcoming():
+                    self._staged[index] = volume
+                # Otherwise the fill fell a full rotation behind and the
+                # sample has already been retired again.
+
+    def _upcoming(self):
+        n = len(self._order)
+        return self._order[(self._next + np.arange(self.replace_num)) % n]
+
+    def start(self):
+        """
+        Loads the initial slots, then the first replacements, in the background.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._fill, daemon=True)
+            self._thread.start()
+            for index in np.concatenate([self._slots, self._upcoming()]):
+                self._queue.put(index)
+
+    def update_cache(self):
+        """
+        Swaps the next `replace_num` samples into the oldest slots and queues
+        the following ones for loading, without waiting for the fill thread.
+        Returns the hit/miss counts and replacement latency since the previous
+        call, and resets them.
+        """
+        stats = self.stats()
+        with self._lock:
+            for index in self._upcoming():
+                self._slots[self._retire] = index
+                # Not staged yet: the fill thread will place it when it is done.
+                self._volumes[self._retire] = self._staged.pop(index, None)
+                self._retire = (self._retire + 1) % self.cache_num
+            self._next = (self._next + self.replace_num) % len(self._order)
+            self._latencies = []
+        with self._hits.get_lock(), self._misses.get_lock():
+            self._hits.value = self._misses.value = 0
+        if self._thread is not None:
+            for index in self._upcoming():
+                self._queue.put(index)
+        return stats
+
+    def stats(self):
+        with self._lock:
+            latencies = np.asarray(self._latencies)
+            resident = sum(v.nbytes for v in self._volumes if v is not None)
+            resident += sum(v.nbytes for v in self._staged.values())
+        hits, misses = self._hits.value, self._misses.value
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / max(hits + misses, 1),
+            'cache_num': self.cache_num,
+            'replace_num': self.replace_num,
+            'replaced': len(latencies),
+            'replace_seconds_mean': float(latencies.mean()) if len(latencies) else 0.0,
+            'replace_seconds_max': float(latencies.max()) if len(latencies) else 0.0,
+            'resident_bytes': int(resident),
+        }
+
+    def state_dict(self):
+        """
+        Position of the rotation, for resuming training where it stopped.
+        """
+        return {'slots': self._slots.copy(), 'next': self._next, 'retire': self._retire}
+
+    def load_state_dict(self, state):
+        """
+        Restores the rotation position. Call before `start()`.
+        """
+        with self._lock:
+            self._slots = np.asarray(state['slots']).copy()
+            self._next, self._retire = state['next'], state['retire']
+            self._volumes = [None] * self.cache_num
+            self._staged = {}
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _transform(self, index):
+        item = dict(self.data[self._slots[index]])
+        volume = self._volumes[index]
+        with self.profiler.span('cache_read'):
+            if volume is None:
+                volume = self._load(item)
+                counter = self._misses
+            else:
+                counter = self._hits
+            item['image'] = decode_volume(volume, self.scale, self.offset)
+        with counter.get_lock():
+            counter.value += 1
+        return self.transform(item) if self.transform is not None else item
+
+    def __getstate__(self):
+        # Spawned workers get the cache contents, without the fill thread.
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_thread'] = None
+        state['_queue'] = None
+        state['_staged'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,181 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from monai.data import MetaTensor
+from monai.data.utils import compute_importance_map
+
+from data_preparation import PREPROCESS_CONFIG
+
+REDUCTIONS = ('max', 'topk')
+
+
+def _window_starts(size, roi, step):
+    """
+    Start offsets along one axis: every `step`, plus a last window flush with the end.
+    """
+    starts = list(range(0, size - roi + 1, step))
+    if starts[-1] + roi < size:
+        starts.append(size - roi)
+    return starts
+
+
+def _model_device(model):
+    try:
+        return next(model.parameters()).device
+    except (AttributeError, StopIteration):
+        # Exported engines run on CPU and have no parameters.
+        return torch.device('cpu')
+
+
+class SlidingWindowScorer:
+    """
+    Scores a full-resolution volume with a model trained on fixed-size inputs.
+
+    The volume is covered by windows of `roi_size` overlapping by `overlap`
+    (a fraction of the window), which go through the model `sw_batch_size`
+    at a time; larger batches pay off on GPUs, while on CPU one window per
+    pass is usually fastest. Their aneurysm probabilities are blended with a
+    Gaussian importance map, so window borders weigh less than centres.
+
+    Windows are visited one slab at a time along the first axis. Once no
+    later window reaches a slice, its blended probabilities are folded into
+    the score and dropped: only one `roi_size[0]`-deep slab of probabilities
+    is held, never the full-resolution logits.
+
+    The score is the highest blended probability (`reduction='max'`) or the
+    mean of the `top_k` highest (`'topk'`), which is less sensitive to a
+    single noisy voxel. After each call, `windows_run` holds the number of
+    windows that went through the model.
+    """
+
+    def __init__(self, roi_size=PREPROCESS_CONFIG['spatial_size'], overlap=0.25, sw_batch_size=1,
+                 reduction='max', top_k=1000, sigma_scale=0.125, pad_value=PREPROCESS_CONFIG['b_min']):
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction {reduction!r}; expected one of {REDUCTIONS}")
+        if not 0 <= overlap < 1:
+            raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+        self.roi_size = tuple(int(r) for r in roi_size)
+        self.overlap = overlap
+        self.sw_batch_size = sw_batch_size
+        self.reduction = reduction
+        self.top_k = top_k
+        self.pad_value = pad_value
+        self.importance = compute_importance_map(self.roi_size, mode='gaussian', sigma_scale=sigma_scale,
+                                                 device='cpu').float()
+        self.windows_run = 0
+
+    def window_grid(self, shape):
+        """
+        Start offsets of the windows along each axis of a `(D, H, W)` volume.
+        """
+        return [_window_starts(max(size, roi), roi, max(int(roi * (1 - self.overlap)), 1))
+                for size, roi in zip(shape, self.roi_size)]
+
+    def input_shapes(self):
+        """
+        Batch shapes the model is called with, e.g. to warm up a compiled model.
+        The last batch of a slab is padded to the same shape.
+        """
+        return [(self.sw_batch_size, 1, *self.roi_size)]
+
+    def num_windows(self, shape):
+        zs, ys, xs = self.window_grid(shape)
+        return len(zs) * len(ys) * len(xs)
+
+    def _select(self, mask, shape):
+        """
+        Marks the windows that cover at least one True voxel of `mask`, a
+        boolean map of the same field of view at any resolution.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        grid = self.window_grid(shape)
+        boxes = []
+        for starts, roi, size, mask_size in zip(grid, self.roi_size, shape, mask.shape):
+            scale = mask_size / size
+            lo = [int(np.floor(s * scale)) for s in starts]
+            hi = [max(int(np.ceil(min(s + roi, size) * scale)), l + 1) for s, l in zip(starts, lo)]
+            boxes.append(list(zip(lo, hi)))
+        selected = np.zeros([len(starts) for starts in grid], dtype=bool)
+        for i, (z0, z1) in enumerate(boxes[0]):
+            for j, (y0, y1) in enumerate(boxes[1]):
+                for k, (x0, x1) in enumerate(boxes[2]):
+                    selected[i, j, k] = mask[z0:z1, y0:y1, x0:x1].any()
+        return selected
+
+    def _reduce(self, state, probs):
+        if self.reduction == 'max':
+            return probs.max() if state is None else torch.maximum(state, probs.max())
+        values = probs.flatten() if state is None else torch.cat([state, probs.flatten()])
+        return values.topk(min(self.top_k, values.numel())).values
+
+    def _finish(self, state):
+        if state is None:
+            return None
+        return float(state if self.reduction == 'max' else state.mean())
+
+    def reduce(self, probs):
+        """
+        Reduces a whole probability map to a score, e.g. a low-resolution one.
+        """
+        return self._finish(self._reduce(None, torch.as_tensor(probs).float()))
+
+    def __call__(self, model, image, mask=None):
+        """
+        Returns the score of a channel-first `(1, D, H, W)` volume. `model`
+        maps a `(B, 1, *roi_size)` batch to two-class logits.
+
+        With a boolean `mask` covering the same field of view (at any
+        resolution), only the windows over a True voxel are run and the score
+        covers the voxels they reach; it is None if no window is run.
+        """
+        x = (image.as_tensor() if isinstance(image, MetaTensor) else torch.as_tensor(image)).float()
+        shape = x.shape[1:]
+        # Volumes smaller than a window are padded up to it.
+        pad = [max(roi - size, 0) for size, roi in zip(shape, self.roi_size)]
+        if any(pad):
+            x = F.pad(x, [p for n in reversed(pad) for p in (0, n)], value=self.pad_value)
+        depth, height, width = x.shape[1:]
+        rz, ry, rx = self.roi_size
+        zs, ys, xs = self.window_grid(shape)
+        selected = self._select(mask, shape) if mask is not None else None
+        device = _model_device(model)
+
+        blended = torch.zeros((rz, height, width))
+        weights = torch.zeros((rz, height, width))
+
+        state = None
+        self.windows_run = 0
+        for i, z in enumerate(zs):
+            row = [(y, x0) for j, y in enumerate(ys) for k, x0 in enumerate(xs)
+                   if selected is None or selected[i, j, k]]
+            for b in range(0, len(row), self.sw_batch_size):
+                windows = row[b:b + self.sw_batch_size]
+                batch = torch.stack([x[:, z:z + rz, y:y + ry, x0:x0 + rx] for y, x0 in windows])
+                if len(windows) < self.sw_batch_size:
+                    # Short batches are padded, so the model only sees the warmed-up shape.
+                    batch = F.pad(batch, [0] * 8 + [0, self.sw_batch_size - len(windows)])
+                # Only the model runs in inference mode: compiled models are
+                # specialized on whether their inputs are inference tensors.
+                with torch.inference_mode():
+                    logits = model(batch.to(device))[:len(windows)]
+                probs = torch.softmax(logits.float(), dim=1)[:, 1].cpu() * self.importance
+                for p, (y, x0) in zip(probs, windows):
+                    blended[:, y:y + ry, x0:x0 + rx] += p
+                    weights[:, y:y + ry, x0:x0 + rx] += self.importance
+            self.windows_run += len(row)
+
+            # Slices before the next slab's start are final.
+            done = (zs[i + 1] if i + 1 < len(zs) else depth) - z
+            valid = min(done, shape[0] - z)
+            if valid > 0:
+                w = weights[:valid, :shape[1], :shape[2]]
+                # Voxels that no window reached (outside the mask) do not count.
+                covered = w > 0
+                if covered.any():
+                    state = self._reduce(state, blended[:valid, :shape[1], :shape[2]][covered] / w[covered])
+            if i + 1 < len(zs):
+                blended[:rz - done] = blended[done:].clone()
+                blended[rz - done:] = 0
+                weights[:rz - done] = weights[done:].clone()
+                weights[rz - done:] = 0
+        return self._finish(state)
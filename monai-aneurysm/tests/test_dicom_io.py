@@ -0,0 +1,69 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import dicom2nifti
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+# The scripts import each other as top-level modules.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dicom_io import LoadVolumed
+
+SHAPE = (12, 40, 32)  # slices, rows, columns
+PIXEL_SPACING = (0.5, 0.6)  # between rows, between columns
+SLICE_STEP = 1.5
+
+
+def write_series(series_dir, orientation, seed=0):
+    """
+    Writes a CT series of random slices, in shuffled file order, with the
+    given ImageOrientationPatient.
+    """
+    os.makedirs(series_dir)
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 2000, size=SHAPE, dtype=np.uint16)
+    row, col = np.asarray(orientation[:3], float), np.asarray(orientation[3:], float)
+    normal = np.cross(row, col)
+    series_uid, study_uid, frame_uid = generate_uid(), generate_uid(), generate_uid()
+    for k in rng.permutation(SHAPE[0]):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+        ds.SOPClassUID, ds.SOPInstanceUID = CTImageStorage, meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID, ds.StudyInstanceUID, ds.FrameOfReferenceUID = series_uid, study_uid, frame_uid
+        ds.Modality, ds.Manufacturer, ds.PatientID = 'CT', 'SIEMENS', 'synthetic'
+        ds.InstanceNumber = int(k) + 1
+        ds.ImageOrientationPatient = [float(v) for v in orientation]
+        ds.ImagePositionPatient = [float(v) for v in np.array([-10.0, 20.0, 30.0]) + k * SLICE_STEP * normal]
+        ds.PixelSpacing = list(PIXEL_SPACING)
+        ds.SliceThickness = SLICE_STEP
+        ds.Rows, ds.Columns = SHAPE[1:]
+        ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, 'MONOCHROME2'
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+        ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+        ds.PixelData = pixels[k].tobytes()
+        ds.save_as(os.path.join(series_dir, f"{k:03d}.dcm"), enforce_file_format=True)
+
+
+@pytest.mark.parametrize('orientation', [
+    [1, 0, 0, 0, 1, 0],  # axial
+    [1, 0, 0, 0, 0, -1],  # coronal
+    [0, 1, 0, 0, 0, -1],  # sagittal
+])
+def test_dicom_matches_converted_nifti(tmp_path, orientation):
+    series_dir = str(tmp_path / 'series')
+    nifti_path = str(tmp_path / 'series.nii.gz')
+    write_series(series_dir, orientation)
+    dicom2nifti.dicom_series_to_nifti(series_dir, nifti_path, reorient_nifti=True)
+
+    load = LoadVolumed(keys=['image'])
+    direct = load({'image': series_dir})['image']
+    converted = load({'image': nifti_path})['image']
+
+    assert direct.shape == converted.shape
+    np.testing.assert_array_equal(direct.numpy(), converted.numpy())
+    np.testing.assert_allclose(direct.affine.numpy(), converted.affine.numpy(), atol=1e-4)
@@ -1,109 +1,311 @@
 import os
+import time
+import argparse
+import contextlib
 import torch
+from torch.nn.parallel import DistributedDataParallel
 from tqdm import tqdm
 from monai.losses import DiceLoss
-from monai.metrics import DiceMetric
-from monai.data import decollate_batch
-from monai.transforms import AsDiscrete
 from monai.utils import set_determinism
 
 from model import create_model
+from compiled import compile_model
+from utils import as_plain_tensor
+from profiling import Profiler, format_summary
+from checkpoint import LAST_CHECKPOINT, AsyncCheckpointer, load_checkpoint, rng_state, set_rng_state
+from distributed import all_reduce_sum, cleanup, init_distributed, is_main_process, local_rank
+from precision import PRECISIONS, autocast, check_precision, grad_scaler, to_channels_last
 from data_preparation import get_data_dicts, create_dataloaders
+from rotating_cache import RotatingCacheDataset
+from validation import ValidationWorker, validate
 
 # Define paths
 CSV_PATH = 'merged_medical_data.csv'
 NIFTI_DIR = 'nifti_files'
 CHECKPOINT_DIR = './checkpoints'
+BEST_MODEL = 'best_metric_model.pth'
+# Preprocessed volumes, shared with evaluate.py
+CACHE_DIR = './cache'
 os.makedirs(CHECKPOINT_DIR, exist_ok=True)
 
 # Set determinism for reproducibility
 set_determinism(seed=42)
 
-def train_model(max_epochs=10, batch_size=1, learning_rate=1e-4):
+def _log(*args):
+    # Only rank 0 reports in distributed runs.
+    if is_main_process():
+        print(*args)
+
+def _report(results, best_metric, best_metric_epoch):
+    """
+    Logs validation results and returns the updated best metric and epoch.
+    """
+    for result in results:
+        _log(f"Epoch {result['epoch']} mean dice: {result['metric']:.4f} "
+             f"(validated in {result['seconds']:.1f}s)")
+        if result['saved']:
+            best_metric, best_metric_epoch = result['metric'], result['epoch']
+            _log("Saved new best metric model")
+    return best_metric, best_metric_epoch
+
+def train_model(max_epochs=10, batch_size=1, learning_rate=1e-4, precision='fp32', channels_last=False,
+                accumulation_steps=1, resume=None, checkpoint_every=1, async_validation=False,
+                validation_threads=1, compiled=False, profile_dir=None, **loader_kwargs):
     """
     Main training function.
+
+    When launched with torchrun, each process trains on its shard of the data
+    and gradients are all-reduced (gloo backend, so it also runs on CPU-only
+    nodes); only rank 0 logs and writes checkpoints. Gradients are accumulated
+    over `accumulation_steps` batches before each optimizer step, so the
+    effective batch size is `batch_size * accumulation_steps * world_size`.
+
+    Every `checkpoint_every` epochs the full training state (model, optimizer,
+    loss scaler, epoch, best metric and every RNG state) is written to
+    `CHECKPOINT_DIR/last.pth` by a background thread. Pass that file as
+    `resume` to continue the run exactly where it stopped.
+
+    With `async_validation`, each epoch's weights are validated by a separate
+    process using `validation_threads` threads, and training continues
+    meanwhile. That process saves the best model; its results are picked up as
+    they arrive. In distributed runs only rank 0 validates.
+
+    `precision` selects mixed-precision training: 'bf16' (autocast, suited to
+    CPUs with bf16 support) or 'fp16' (autocast with loss scaling). With
+    `channels_last`, the model and inputs use the channels-last-3d layout.
+
+    With `compiled`, training and validation run the model through
+    `torch.compile`, with artifacts cached across runs; the first step, which
+    includes compilation, is timed separately.
+
+    With `profile_dir`, every preprocessing stage, cache read and collation
+    (in the loader workers too) and each phase of a training step (waiting on
+    the loader, host-to-device copy, forward, backward, optimizer step) is
+    timed; per-stage latencies and a Chrome trace are written there at the
+    end. Each rank records its own spans; rank 0 writes the report.
+
+    Extra keyword arguments (`num_workers`, `persistent_workers`, `pin_memory`,
+    `prefetch_factor`, `cache_rate`, `replace_rate`) are passed to
+    `create_dataloaders`.
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    _, world_size = init_distributed()
+    distributed = world_size > 1
+    device = torch.device(f"cuda:{local_rank()}" if torch.cuda.is_available() else "cpu")
+    check_precision(device, precision)
+    profiler = Profiler(profile_dir, clear=is_main_process())
 
     # Create model, loss function, and optimizer
-    model = create_model().to(device)
+    model = to_channels_last(create_model().to(device), channels_last)
+    # Checkpoints hold the state dict of the plain module.
+    bare_model = model
+    if distributed:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    if compiled:
+        model = compile_model(model)
     loss_function = DiceLoss(to_onehot_y=True, softmax=True)
     optimizer = torch.optim.Adam(model.parameters(), learning_rate)
-
-    # Metric for validation
-    dice_metric = DiceMetric(include_background=False, reduction="mean")
+    scaler = grad_scaler(device, precision)
 
     # Prepare data
     data_dicts = get_data_dicts(CSV_PATH, NIFTI_DIR)
     if not data_dicts:
-        print("No data found. Please run data_preparation.py first to convert DICOM to NIfTI.")
+        _log("No data found. Please run data_preparation.py first to convert DICOM to NIfTI.")
         return
 
-    train_loader, val_loader = create_dataloaders(data_dicts, batch_size=batch_size)
+    train_loader, val_loader = create_dataloaders(data_dicts, batch_size=batch_size, cache_dir=CACHE_DIR,
+                                                  distributed=distributed, profiler=profiler, **loader_kwargs)
 
-    # Post-processing for metric calculation
-    post_pred = AsDiscrete(argmax=True, to_onehot=2)
-    post_label = AsDiscrete(to_onehot=2)
+    # In-RAM rotating sample cache, if enabled with `cache_rate`
+    sample_cache = train_loader.dataset if isinstance(train_loader.dataset, RotatingCacheDataset) else None
 
     best_metric = -1
     best_metric_epoch = -1
+    start_epoch = 0
+    train_transform = train_loader.dataset.transform
+
+    if resume is not None:
+        state = load_checkpoint(resume, device)
+        bare_model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        scaler.load_state_dict(state['scaler'])
+        start_epoch = state['epoch']
+        best_metric, best_metric_epoch = state['best_metric'], state['best_metric_epoch']
+        if sample_cache is not None and state['sample_cache'] is not None:
+            sample_cache.load_state_dict(state['sample_cache'])
+        set_rng_state(state['rng'], train_transform)
+        _log(f"Resumed from {resume} after epoch {start_epoch}")
+
+    if sample_cache is not None:
+        sample_cache.start()
+
+    # Only rank 0 writes checkpoints
+    checkpointer = AsyncCheckpointer(CHECKPOINT_DIR) if is_main_process() else None
+    validator = None
+    if async_validation and is_main_process():
+        validator = ValidationWorker(
+            val_loader.dataset,
+            os.path.join(CHECKPOINT_DIR, BEST_MODEL),
+            best_metric=best_metric,
+            batch_size=val_loader.batch_size,
+            precision=precision,
+            channels_last=channels_last,
+            num_threads=validation_threads,
+            compiled=compiled,
+        )
 
-    print("Starting training...")
-    for epoch in range(max_epochs):
-        print("-" * 10)
-        print(f"Epoch {epoch + 1}/{max_epochs}")
+    def full_state(epoch):
+        return {
+            'model': bare_model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scaler': scaler.state_dict(),
+            'epoch': epoch,
+            'best_metric': best_metric,
+            'best_metric_epoch': best_metric_epoch,
+            'sample_cache': sample_cache.state_dict() if sample_cache is not None else None,
+            'rng': rng_state(train_transform),
+        }
+
+    _log(f"Starting training on {world_size} process(es)...")
+    for epoch in range(start_epoch, max_epochs):
+        _log("-" * 10)
+        _log(f"Epoch {epoch + 1}/{max_epochs}")
+        epoch_start = time.perf_counter()
 
         model.train()
+        if distributed:
+            train_loader.sampler.set_epoch(epoch)
         epoch_loss = 0
         step = 0
 
         # Training loop
-        for batch_data in tqdm(train_loader, desc="Training"):
+        optimizer.zero_grad()
+        batches = tqdm(train_loader, desc="Training", disable=not is_main_process())
+        for batch_data in profiler.iterate(batches):
             step += 1
-            inputs, labels = batch_data["image"].to(device), batch_data["label"].to(device)
-            optimizer.zero_grad()
-            outputs = model(inputs)
-            loss = loss_function(outputs, labels.unsqueeze(1))
-            loss.backward()
-            optimizer.step()
+            step_start = time.perf_counter()
+            with profiler.span('host_to_device', device):
+                inputs, labels = batch_data["image"].to(device), batch_data["label"].to(device)
+                inputs = to_channels_last(as_plain_tensor(inputs), channels_last)
+            # Gradients are only all-reduced on the last batch of each window.
+            update = step % accumulation_steps == 0 or step == len(train_loader)
+            # The last window of an epoch may be shorter; average over its own batches.
+            window_start = (step - 1) // accumulation_steps * accumulation_steps
+            window_size = min(accumulation_steps, len(train_loader) - window_start)
+            with model.no_sync() if distributed and not update else contextlib.nullcontext():
+                with profiler.span('forward', device):
+                    with autocast(device, precision):
+                        outputs = model(inputs)
+                    # The loss is computed in fp32 for a stable softmax.
+                    loss = loss_function(outputs.float(), labels.unsqueeze(1))
+                with profiler.span('backward', device):
+                    scaler.scale(loss / window_size).backward()
+            if update:
+                with profiler.span('optimizer', device):
+                    scaler.step(optimizer)
+                    scaler.update()
+                    optimizer.zero_grad()
             epoch_loss += loss.item()
+            if compiled and epoch == start_epoch and step == 1:
+                _log(f"First step (including compilation): {time.perf_counter() - step_start:.1f}s")
 
+        epoch_loss, step = all_reduce_sum([epoch_loss, step])
         epoch_loss /= step
-        print(f"Epoch {epoch + 1} average loss: {epoch_loss:.4f}")
-
-        # Validation loop
-        model.eval()
-        with torch.no_grad():
-            for val_data in tqdm(val_loader, desc="Validation"):
-                val_inputs, val_labels = val_data["image"].to(device), val_data["label"].to(device)
-                val_outputs = model(val_inputs)
-
-                # Convert outputs and labels to one-hot format for metric calculation
-                val_outputs = [post_pred(i) for i in decollate_batch(val_outputs)]
-                val_labels = [post_label(i) for i in decollate_batch(val_labels.unsqueeze(1))]
+        _log(f"Epoch {epoch + 1} average loss: {epoch_loss:.4f}, "
+             f"training time: {time.perf_counter() - epoch_start:.1f}s")
 
-                dice_metric(y_pred=val_outputs, y=val_labels)
+        if sample_cache is not None:
+            stats = sample_cache.update_cache()
+            _log(f"Sample cache hit rate: {stats['hit_rate']:.1%}, "
+                 f"replacement latency: {stats['replace_seconds_mean'] * 1000:.0f} ms/sample "
+                 f"(max {stats['replace_seconds_max'] * 1000:.0f} ms)")
 
-            metric = dice_metric.aggregate().item()
-            dice_metric.reset()
+        # Validation
+        results = []
+        if validator is not None:
+            results = validator.poll()
+            # The last epoch is always validated, even if that means waiting.
+            if not validator.submit(epoch + 1, bare_model.state_dict(), block=epoch + 1 == max_epochs):
+                _log(f"Validation worker busy; epoch {epoch + 1} is not validated")
+        elif not async_validation:
+            val_start = time.perf_counter()
+            with profiler.span('validation', device):
+                metric_sum, count = validate(model, val_loader, device, precision, channels_last,
+                                             progress=is_main_process())
+            # Combine the per-rank means, weighted by their non-NaN counts.
+            metric_sum, count = all_reduce_sum([metric_sum, count])
+            metric = metric_sum / count if count else 0.0
+            if metric > best_metric and checkpointer is not None:
+                checkpointer.save(bare_model.state_dict(), BEST_MODEL)
+            results = [{'epoch': epoch + 1, 'metric': metric, 'saved': metric > best_metric,
+                        'seconds': time.perf_counter() - val_start}]
+        best_metric, best_metric_epoch = _report(results, best_metric, best_metric_epoch)
 
-            print(f"Current epoch: {epoch + 1}, current mean dice: {metric:.4f}")
+        if checkpointer is not None and ((epoch + 1) % checkpoint_every == 0 or epoch + 1 == max_epochs):
+            checkpointer.save(full_state(epoch + 1), LAST_CHECKPOINT)
 
-            if metric > best_metric:
-                best_metric = metric
-                best_metric_epoch = epoch + 1
-                torch.save(model.state_dict(), os.path.join(CHECKPOINT_DIR, "best_metric_model.pth"))
-                print("Saved new best metric model")
-
-    print(f"Training complete. Best metric: {best_metric:.4f} at epoch: {best_metric_epoch}")
+    if validator is not None:
+        best_metric, best_metric_epoch = _report(validator.close(), best_metric, best_metric_epoch)
+        if checkpointer is not None and max_epochs > start_epoch:
+            # Record the results that arrived after the last checkpoint.
+            checkpointer.save(full_state(max_epochs), LAST_CHECKPOINT)
+    if checkpointer is not None:
+        checkpointer.close()
+    if sample_cache is not None:
+        sample_cache.shutdown()
+    _log(f"Training complete. Best metric: {best_metric:.4f} at epoch: {best_metric_epoch}")
+    if profiler.enabled and is_main_process():
+        _log(format_summary(profiler.export()))
+        _log(f"Stage timings and Chrome trace written to {profile_dir}")
+    profiler.close()
+    cleanup()
 
 if __name__ == '__main__':
     # Before running training, make sure the data preparation step has been completed.
     # The data_preparation.py script should be run to convert DICOM files to NIfTI format.
     # We can't run it here due to the potential long processing time.
 
+    # Multi-process training is launched with torchrun, e.g. on one node:
+    #   torchrun --nproc_per_node=4 monai-aneurysm/train.py
+    # or across HPC nodes:
+    #   torchrun --nnodes=2 --nproc_per_node=4 --rdzv_backend=c10d --rdzv_endpoint=$HEAD:29500 monai-aneurysm/train.py
+    parser = argparse.ArgumentParser(description="Train the aneurysm UNet.")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--accumulation-steps', type=int, default=1,
+                        help="Batches per optimizer step.")
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--precision', choices=PRECISIONS, default='fp32')
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--resume', default=None, metavar='CHECKPOINT',
+                        help=f"Continue from a full-state checkpoint, e.g. {CHECKPOINT_DIR}/{LAST_CHECKPOINT}.")
+    parser.add_argument('--checkpoint-every', type=int, default=1,
+                        help="Epochs between full-state checkpoints.")
+    parser.add_argument('--async-validation', action='store_true',
+                        help="Validate in a separate process while training continues.")
+    parser.add_argument('--validation-threads', type=int, default=1)
+    parser.add_argument('--compile', action='store_true',
+                        help="Run the model through torch.compile, caching compiled artifacts.")
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help="Time each pipeline stage and write per-stage latencies and a Chrome trace to DIR.")
+    args = parser.parse_args()
+
     # Check if NIfTI files exist
     if not os.listdir(NIFTI_DIR):
         print("NIfTI directory is empty. Please run `python monai-aneurysm/data_preparation.py` first.")
     else:
-        train_model()
\ No newline at end of file
+        train_model(
+            max_epochs=args.epochs,
+            batch_size=args.batch_size,
+            learning_rate=args.learning_rate,
+            precision=args.precision,
+            channels_last=args.channels_last,
+            accumulation_steps=args.accumulation_steps,
+            resume=args.resume,
+            checkpoint_every=args.checkpoint_every,
+            async_validation=args.async_validation,
+            validation_threads=args.validation_threads,
+            compiled=args.compile,
+            profile_dir=args.profile,
+            num_workers=args.num_workers,
+        )
\ No newline at end of file
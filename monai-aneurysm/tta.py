@@ -0,0 +1,65 @@
+import itertools
+
+import torch
+
+# Sets of flipped views, each a tuple of the spatial axes (0-2) it flips; ()
+# is the volume as is. 'lr' matches the training augmentation, which flips
+# the first spatial axis.
+TTA_PRESETS = {
+    'none': [()],
+    'lr': [(), (0,)],
+    'axes': [(), (0,), (1,), (2,)],
+    'all': [axes for n in range(4) for axes in itertools.combinations(range(3), n)],
+}
+
+
+def view_shapes(shapes, flips):
+    """
+    Batch shapes a model wrapped in `FlipTTA(model, flips)` is called with
+    when the wrapper gets batches of `shapes`, e.g. to warm it up.
+    """
+    return [(len(flips) * shape[0], *shape[1:]) for shape in shapes]
+
+
+class FlipTTA(torch.nn.Module):
+    """
+    Test-time augmentation by flips, in a single forward pass.
+
+    Every view of a `(B, 1, D, H, W)` batch is stacked into one
+    `(views * B, 1, D, H, W)` batch for `model`, a `create_model()` model or
+    an `InferenceEngine`. Each view's probabilities are flipped back and
+    summed in place into the first. The result is returned as log
+    probabilities, so a softmax over the channels, as every scorer applies
+    to logits, gives the averaged probabilities; the wrapper is a drop-in
+    model for `evaluate.py`, the scorers and the inference server.
+
+    `flips` is a list of views as in `TTA_PRESETS`. The model sees `views`
+    times the batch (see `view_shapes()`).
+    """
+
+    def __init__(self, model, flips=TTA_PRESETS['lr']):
+        super().__init__()
+        if not flips:
+            raise ValueError("FlipTTA needs at least one view")
+        self.model = model
+        # Spatial axes of a (B, C, D, H, W) tensor.
+        self.dims = [tuple(axis + 2 for axis in axes) for axes in flips]
+
+    @property
+    def views(self):
+        return len(self.dims)
+
+    def forward(self, x):
+        batch_size = len(x)
+        batch = torch.cat([x.flip(dims) if dims else x for dims in self.dims])
+        logits = self.model(batch)
+        # Engines return inference tensors, which only change in place here.
+        with torch.inference_mode():
+            probs = torch.softmax(logits.float(), dim=1)
+            merged = probs[:batch_size]
+            if self.dims[0]:
+                merged = merged.flip(self.dims[0])
+            for view, dims in enumerate(self.dims[1:], start=1):
+                probs_view = probs[view * batch_size:(view + 1) * batch_size]
+                merged += probs_view.flip(dims) if dims else probs_view
+            return merged.div_(self.views).log_()
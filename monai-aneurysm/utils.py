@@ -1,2 +1,30 @@
 # This file will contain utility functions.
-pass
\ No newline at end of file
+import resource
+
+from monai.data import MetaTensor
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of this process.
+
+    Reads VmHWM, which starts afresh in a spawned child; `ru_maxrss` carries
+    the parent's peak over across exec on Linux.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # No procfs (e.g. macOS, which reports bytes).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def as_plain_tensor(x):
+    """
+    Returns the plain tensor behind a MetaTensor. Compiled models cannot take
+    MetaTensors, and eager models skip the metadata bookkeeping of every op.
+    """
+    return x.as_tensor() if isinstance(x, MetaTensor) else x
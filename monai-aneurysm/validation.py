@@ -0,0 +1,158 @@
+import os
+import time
+import queue
+
+import torch
+import torch.multiprocessing
+from tqdm import tqdm
+from monai.data import DataLoader, decollate_batch
+from monai.metrics import DiceMetric
+from monai.transforms import AsDiscrete
+
+from checkpoint import snapshot_state
+from compiled import compile_model
+from model import create_model
+from precision import autocast, to_channels_last
+from utils import as_plain_tensor
+
+
+def validate(model, val_loader, device, precision='fp32', channels_last=False, progress=False):
+    """
+    Runs the validation loop. Returns `(metric_sum, count)`: the sum of the
+    per-sample mean dice and the number of samples it covers, so results from
+    several processes can be combined before dividing.
+    """
+    dice_metric = DiceMetric(include_background=False, reduction="mean", get_not_nans=True)
+    # Post-processing for metric calculation
+    post_pred = AsDiscrete(argmax=True, to_onehot=2)
+    post_label = AsDiscrete(to_onehot=2)
+
+    model.eval()
+    with torch.no_grad():
+        for val_data in tqdm(val_loader, desc="Validation", disable=not progress):
+            val_inputs, val_labels = val_data["image"].to(device), val_data["label"].to(device)
+            with autocast(device, precision):
+                val_outputs = model(to_channels_last(as_plain_tensor(val_inputs), channels_last)).float()
+
+            # Convert outputs and labels to one-hot format for metric calculation
+            val_outputs = [post_pred(i) for i in decollate_batch(val_outputs)]
+            val_labels = [post_label(i) for i in decollate_batch(val_labels.unsqueeze(1))]
+
+            dice_metric(y_pred=val_outputs, y=val_labels)
+
+    metric, not_nans = dice_metric.aggregate()
+    count = not_nans.item()
+    return (metric.item() * count if count else 0.0), count
+
+
+def _worker_main(val_dataset, batch_size, jobs, results, best_model_path, best_metric, precision, channels_last,
+                 num_threads, compiled):
+    torch.set_num_threads(num_threads)
+    model = to_channels_last(create_model(), channels_last)
+    device = next(model.parameters()).device
+    # Weights are loaded into `model`; the compiled wrapper shares them.
+    net = compile_model(model) if compiled else model
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, num_workers=0)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            results.put(None)
+            return
+        epoch, state_dict = job
+        start = time.perf_counter()
+        model.load_state_dict(state_dict)
+        metric_sum, count = validate(net, val_loader, device, precision, channels_last)
+        metric = metric_sum / count if count else 0.0
+
+        saved = metric > best_metric
+        if saved:
+            best_metric = metric
+            tmp_path = f"{best_model_path}.{os.getpid()}.tmp"
+            torch.save(model.state_dict(), tmp_path)
+            os.replace(tmp_path, best_model_path)
+        results.put({'epoch': epoch, 'metric': metric, 'saved': saved, 'seconds': time.perf_counter() - start})
+
+
+class ValidationWorker:
+    """
+    Validates weight snapshots in a separate process while training continues.
+
+    `submit()` hands the worker a copy of the weights; the worker runs the
+    validation loop on its own model and, when the metric improves, writes
+    `best_model_path` itself. Results are collected with `poll()` (and
+    `close()` at the end) as dicts with the epoch, metric, whether the model
+    was saved and the validation time. With `compiled`, the worker runs the
+    model through `torch.compile`.
+
+    At most one snapshot waits while another is being validated; `submit()`
+    returns False instead of stalling training when that slot is taken.
+
+    If the worker process dies, the next `submit()`, `poll()` or `close()`
+    raises a RuntimeError with its exit code instead of waiting on it.
+    """
+
+    def __init__(self, val_dataset, best_model_path, best_metric=-1, batch_size=1, precision='fp32',
+                 channels_last=False, num_threads=1, compiled=False):
+        context = torch.multiprocessing.get_context('spawn')
+        self._jobs = context.Queue(maxsize=1)
+        self._results = context.Queue()
+        self._process = context.Process(
+            target=_worker_main,
+            args=(val_dataset, batch_size, self._jobs, self._results, best_model_path, best_metric,
+                  precision, channels_last, num_threads, compiled),
+            daemon=True,
+        )
+        self._process.start()
+
+    def _check_alive(self):
+        if not self._process.is_alive():
+            raise RuntimeError(f"Validation worker died (exit code {self._process.exitcode})")
+
+    def _put(self, job, block):
+        # A dead worker never frees the slot; re-check it while waiting.
+        while True:
+            self._check_alive()
+            try:
+                self._jobs.put(job, timeout=1) if block else self._jobs.put_nowait(job)
+                return True
+            except queue.Full:
+                if not block:
+                    return False
+
+    def submit(self, epoch, state_dict, block=False):
+        self._check_alive()
+        return self._put((epoch, snapshot_state(state_dict)), block)
+
+    def poll(self):
+        """
+        Returns the results that have arrived since the last call, without waiting.
+        """
+        found = []
+        while True:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            found.append(result)
+        self._check_alive()
+        return found
+
+    def close(self):
+        """
+        Waits for the queued snapshots to be validated and returns their results.
+        """
+        self._put(None, block=True)
+        found = []
+        while True:
+            try:
+                result = self._results.get(timeout=1)
+            except queue.Empty:
+                # Only a crash ends the worker before it confirms the shutdown.
+                self._check_alive()
+                continue
+            if result is None:
+                break
+            found.append(result)
+        self._process.join()
+        return found
@@ -0,0 +1,222 @@
+import os
+import json
+import zlib
+import struct
+
+import numpy as np
+import torch
+from monai.data import MetaTensor
+from monai.transforms import MapTransform, Randomizable
+
+# File layout:
+#   MAGIC | uint64 header length | JSON header | uint64[n_chunks, 2] index | chunks
+# where each index row is the (offset, length) of one zlib-compressed chunk,
+# in C order over the chunk grid.
+MAGIC = b'AVOLUME1'
+DEFAULT_CHUNK_SHAPE = (64, 64, 64)
+
+# Storage dtypes for volumes at rest. Values are decoded back to float32 as
+# `stored * scale + offset` by whoever reads them.
+STORAGE_DTYPES = ('float32', 'float16', 'int16')
+INT16_MAX = 32767
+
+
+def encode_volume(volume, storage_dtype='int16', value_range=None):
+    """
+    Converts a volume to a compact storage dtype.
+
+    For int16, integer-valued data that fits (e.g. HU) is stored as is. Anything
+    else is mapped linearly from `value_range` (default: the data range) onto
+    the int16 range. Returns `(stored, scale, offset)`.
+    """
+    volume = np.asarray(volume)
+    if storage_dtype == 'float32':
+        return volume.astype(np.float32, copy=False), 1.0, 0.0
+    if storage_dtype == 'float16':
+        return volume.astype(np.float16), 1.0, 0.0
+    if storage_dtype != 'int16':
+        raise ValueError(f"Unsupported storage dtype {storage_dtype!r}; expected one of {STORAGE_DTYPES}")
+
+    if value_range is None:
+        lo, hi = float(volume.min()), float(volume.max())
+        if -INT16_MAX <= lo and hi <= INT16_MAX and np.array_equal(volume, np.round(volume)):
+            return volume.astype(np.int16), 1.0, 0.0
+    else:
+        lo, hi = value_range
+    offset = (hi + lo) / 2.0
+    scale = max(hi - lo, 1e-12) / (2 * INT16_MAX)
+    stored = np.clip(np.round((volume - offset) / scale), -INT16_MAX, INT16_MAX).astype(np.int16)
+    return stored, scale, offset
+
+
+def decode_volume(stored, scale=1.0, offset=0.0):
+    """
+    Converts a stored volume back to a new, writable float32 array.
+    """
+    volume = np.array(stored, dtype=np.float32)
+    if scale != 1.0:
+        volume *= np.float32(scale)
+    if offset != 0.0:
+        volume += np.float32(offset)
+    return volume
+
+
+def _chunk_grid(shape, chunk_shape):
+    return tuple(-(-s // c) for s, c in zip(shape, chunk_shape))
+
+
+def write_volume(path, volume, affine=None, chunk_shape=DEFAULT_CHUNK_SHAPE, level=1, scale=1.0, offset=0.0):
+    """
+    Writes a 3D volume as independently compressed chunks with an index.
+
+    For volumes produced by `encode_volume`, pass its `scale` and `offset` so
+    readers can decode them.
+    """
+    volume = np.asarray(volume)
+    grid = _chunk_grid(volume.shape, chunk_shape)
+    header = {
+        'shape': list(volume.shape),
+        'dtype': volume.dtype.str,
+        'chunk_shape': list(chunk_shape),
+        'affine': np.asarray(affine if affine is not None else np.eye(4)).tolist(),
+        'codec': 'zlib',
+        'scale': scale,
+        'offset': offset,
+    }
+    header_bytes = json.dumps(header).encode()
+    index = np.zeros((int(np.prod(grid)), 2), dtype='<u8')
+    position = len(MAGIC) + 8 + len(header_bytes) + index.nbytes
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.seek(position)
+        for n, chunk_pos in enumerate(np.ndindex(*grid)):
+            block = volume[tuple(slice(p * c, (p + 1) * c) for p, c in zip(chunk_pos, chunk_shape))]
+            data = zlib.compress(np.ascontiguousarray(block).tobytes(), level)
+            f.write(data)
+            index[n] = (position, len(data))
+            position += len(data)
+        f.seek(0)
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(index.tobytes())
+    os.replace(tmp_path, path)
+
+
+class ChunkedVolume:
+    """
+    Read-only view of a chunked volume file.
+
+    Only the header and index are read on open; `read_roi` decompresses just
+    the chunks that intersect the requested region. Reads go through
+    `os.pread`, so an instance can be shared across forked loader workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a chunked volume file")
+            (header_len,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len))
+            self.shape = tuple(header['shape'])
+            self.dtype = np.dtype(header['dtype'])
+            self.chunk_shape = tuple(header['chunk_shape'])
+            self.affine = np.asarray(header['affine'])
+            self.scale = header.get('scale', 1.0)
+            self.offset = header.get('offset', 0.0)
+            self.grid = _chunk_grid(self.shape, self.chunk_shape)
+            self.index = np.frombuffer(f.read(int(np.prod(self.grid)) * 16), dtype='<u8').reshape(-1, 2)
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        # File descriptors are reopened after a fork.
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDONLY)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _read_chunk(self, chunk_pos):
+        n = np.ravel_multi_index(chunk_pos, self.grid)
+        offset, length = self.index[n]
+        data = zlib.decompress(os.pread(self._file(), int(length), int(offset)))
+        start = [p * c for p, c in zip(chunk_pos, self.chunk_shape)]
+        shape = [min(c, s - b) for c, s, b in zip(self.chunk_shape, self.shape, start)]
+        return np.frombuffer(data, dtype=self.dtype).reshape(shape)
+
+    def read_roi(self, start, size, fill_value=0, decode=True):
+        """
+        Reads the box `[start, start + size)`. Parts that fall outside the
+        volume are filled with `fill_value`, given in stored units.
+
+        With `decode` (the default) the result is converted to float32 using
+        the stored scale/offset; otherwise it is returned in the stored dtype.
+        """
+        start = np.asarray(start, dtype=np.int64)
+        stop = start + np.asarray(size, dtype=np.int64)
+        out = np.full(tuple(size), fill_value, dtype=self.dtype)
+
+        lo = np.maximum(start, 0)
+        hi = np.minimum(stop, self.shape)
+        if np.any(hi <= lo):
+            return decode_volume(out, self.scale, self.offset) if decode else out
+
+        first = lo // self.chunk_shape
+        last = (hi - 1) // self.chunk_shape
+        for chunk_pos in np.ndindex(*(last - first + 1)):
+            chunk_pos = tuple(first + chunk_pos)
+            chunk = self._read_chunk(chunk_pos)
+            chunk_start = np.asarray(chunk_pos) * self.chunk_shape
+            a = np.maximum(lo, chunk_start)
+            b = np.minimum(hi, chunk_start + chunk.shape)
+            out[tuple(slice(i, j) for i, j in zip(a - start, b - start))] = \
+                chunk[tuple(slice(i, j) for i, j in zip(a - chunk_start, b - chunk_start))]
+        return decode_volume(out, self.scale, self.offset) if decode else out
+
+    def read(self, decode=True):
+        return self.read_roi((0, 0, 0), self.shape, decode=decode)
+
+    def close(self):
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+
+
+def _roi_tensor(store, start, size, path):
+    """
+    Wraps an ROI as a channel-first MetaTensor whose affine points at the ROI origin.
+    """
+    roi = store.read_roi(start, size)
+    shift = np.eye(4)
+    shift[:3, 3] = start
+    return MetaTensor(
+        torch.from_numpy(roi)[None],
+        affine=torch.as_tensor(store.affine @ shift, dtype=torch.float64),
+        meta={'filename_or_obj': path, 'roi_start': np.asarray(start)},
+    )
+
+
+class RandChunkedROId(Randomizable, MapTransform):
+    """
+    Reads a randomly placed `roi_size` box from chunked volume files, touching
+    only the chunks it overlaps.
+    """
+
+    def __init__(self, keys, roi_size, allow_missing_keys=False):
+        MapTransform.__init__(self, keys, allow_missing_keys)
+        self.roi_size = tuple(roi_size)
+        self._start = None
+
+    def randomize(self, shape):
+        self._start = [self.R.randint(0, max(s - r, 0) + 1) for s, r in zip(shape, self.roi_size)]
+
+    def __call__(self, data):
+        d = dict(data)
+        for key in self.key_iterator(d):
+            store = ChunkedVolume(d[key])
+            self.randomize(store.shape)
+            d[key] = _roi_tensor(store, self._start, self.roi_size, d[key])
+            store.close()
+        return d